@@ -0,0 +1,123 @@
+"""
+Admission control and backpressure for the prediction pipeline
+
+AdmissionController bounds how many heavy requests the ASGI server accepts
+(executing plus queued) and how long they may wait for an executor slot;
+ModalityLimiter bounds how many extractions of one modality run at once across
+request threads. Both reject with ServiceOverloaded instead of letting requests
+pile up on hung sockets.
+"""
+import asyncio
+import threading
+from contextlib import contextmanager
+
+class ServiceOverloaded(Exception):
+    """
+    Raised when a request is rejected for capacity; status is 429 or 503
+    """
+    def __init__(self, message, status=503, retry_after=1):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def parse_limits(spec):
+    """
+    {'foot_images': 2, ...} from a 'foot_images=2,pedoscan=4' setting
+    """
+    limits = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        modality, _, limit = item.partition('=')
+        limits[modality.strip()] = int(limit)
+    return limits
+
+class ModalityLimiter:
+    """
+    Per-modality concurrency limits shared by the request threads of a process
+    Modalities without a (positive) limit are not restricted
+    """
+    def __init__(self, limits, timeout=5.0):
+        self.limits = {modality: limit for modality, limit in limits.items() if limit > 0}
+        self.timeout = timeout
+        self.rejected = {}
+        self._semaphores = {modality: threading.BoundedSemaphore(limit) for modality, limit in self.limits.items()}
+
+    @contextmanager
+    def slot(self, modality):
+        semaphore = self._semaphores.get(modality)
+        if semaphore is None:
+            yield
+            return
+
+        if not semaphore.acquire(timeout=self.timeout):
+            self.rejected[modality] = self.rejected.get(modality, 0) + 1
+            raise ServiceOverloaded(f'Too many concurrent {modality} extractions, retry later')
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def stats(self):
+        return {'limits': self.limits, 'timeout_seconds': self.timeout, 'rejected': dict(self.rejected)}
+
+class AdmissionController:
+    """
+    Bounded admission for heavy requests on one event loop
+
+    reserve() admits a request while fewer than max_concurrency + max_queue are
+    in the system and rejects it with 429 otherwise, before its body is read.
+    acquire() then waits up to queue_timeout for one of max_concurrency
+    execution slots and rejects with 503 when none frees up.
+    """
+    def __init__(self, max_concurrency=4, max_queue=16, queue_timeout=10.0, retry_after=1):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._semaphore = None
+
+    def reserve(self):
+        if self.admitted >= self.max_concurrency + self.max_queue:
+            self.rejected_full += 1
+            raise ServiceOverloaded('Server is at capacity, retry later', status=429, retry_after=self.retry_after)
+        self.admitted += 1
+
+    async def acquire(self):
+        # Created on first use so it belongs to the server's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise ServiceOverloaded('Timed out waiting for a prediction worker', status=503,
+                                    retry_after=self.retry_after)
+        self.active += 1
+
+    def release(self, acquired):
+        """
+        End a reserved request; acquired tells whether it held an execution slot
+        """
+        self.admitted -= 1
+        if acquired:
+            self.active -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'queue_timeout_seconds': self.queue_timeout,
+            'active': self.active,
+            'queued': self.admitted - self.active,
+            'completed': self.completed,
+            'rejected_full': self.rejected_full,
+            'rejected_timeout': self.rejected_timeout
+        }
@@ -1,37 +1,174 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, url_for
 from flask_cors import CORS
 import numpy as np
-import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
-import base64
-from io import BytesIO
-from PIL import Image
-import cv2
-import joblib
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingRegressor
-from sklearn.preprocessing import StandardScaler
-from scipy import stats
+import os
+import time
 import warnings
 warnings.filterwarnings('ignore')
 
+from admission import ModalityLimiter, ServiceOverloaded, parse_limits
+from config import config
+from encoding import ResponseEncoder, parse_fields, select_fields
+from feature_cache import build_feature_cache
+from features import (FEATURE_SCHEMA, HISTORY_FEATURES, MAX_FOOT_IMAGES, FeatureMatrix, FeatureVector, as_feature_vector,
+                      image_feature_name)
+from history import build_history_store, parse_exam_time, series_values
+from imaging import ImagePipeline
+from jobs import build_job_runner
+from metrics import METRICS, SamplingProfiler, render_prometheus, stage, timed
+from model_store import load_latest_model, model_feature_matrix
+from pedoscan import (ASYMMETRY_FEATURE_NAMES, FOOT_SIDES, GaitSequenceAccumulator, bilateral_features,
+                      gait_sequence_features, pedoscan_statistics, pedoscan_statistics_many)
+from pressure_io import (as_pressure_frames, as_pressure_matrix, decode_bytes, iter_raw_frames,
+                         unpack_msgpack, MSGPACK_CONTENT_TYPES)
+from progression import ProgressionEngine, DEFAULT_HORIZONS, COMPONENTS as PROGRESSION_COMPONENTS, monthly_horizons
+from recommendation_rules import load_recommendation_rules
+
 app = Flask(__name__)
 CORS(app)
 
+app_config = config.get(os.environ.get('FLASK_ENV'), config['default'])
+app.logger.setLevel(app_config.LOG_LEVEL)
+
+# Longest monthly progression curve a request may ask for (?curve_months=)
+MAX_CURVE_MONTHS = 240
+
+# Features read by the scorers; their defaults come from the feature schema
+SCORING_FEATURES = (
+    'overall_neuropathy_score',
+    'max_pressure',
+    'high_pressure_percentage',
+    'vascular_risk_score',
+    'abi_average',
+    'tbi_average'
+)
+(NEUROPATHY_INDEX, MAX_PRESSURE_INDEX, HIGH_PRESSURE_PERCENTAGE_INDEX,
+ VASCULAR_RISK_INDEX, ABI_AVERAGE_INDEX, TBI_AVERAGE_INDEX) = FEATURE_SCHEMA.indices(SCORING_FEATURES)
+NEUROPATHY_TREND_INDEX, PRESSURE_SLOPE_INDEX = FEATURE_SCHEMA.indices(('neuropathy_trend', 'pressure_slope'))
+
+# Longest page served by /patients/<id>/history
+MAX_HISTORY_PAGE = 500
+
+def risk_level_label(risk):
+    """
+    Map an ulceration risk to its Low / Moderate / High label
+    """
+    return 'Low' if risk < 0.3 else 'Moderate' if risk < 0.6 else 'High'
+
+def observed_trends(values, present):
+    """
+    Neuropathy and pressure slopes from the patient history, NaN where unknown,
+    for the arrays of one FeatureVector or of a FeatureMatrix
+    """
+    return (
+        np.where(present[..., NEUROPATHY_TREND_INDEX], values[..., NEUROPATHY_TREND_INDEX], np.nan),
+        np.where(present[..., PRESSURE_SLOPE_INDEX], values[..., PRESSURE_SLOPE_INDEX], np.nan)
+    )
+
+def reading_array(readings, owners, errors):
+    """
+    float64 array with one row per tuple of readings, and the owners of its rows
+    Tuples with non-numeric readings are left out and their error is set in
+    errors[owner]
+    """
+    try:
+        return np.array(readings, dtype=np.float64).reshape(len(readings), -1), owners
+    except (TypeError, ValueError):
+        rows, kept = [], []
+        for reading, owner in zip(readings, owners):
+            try:
+                rows.append(np.array(reading, dtype=np.float64))
+                kept.append(owner)
+            except (TypeError, ValueError) as e:
+                errors[owner] = e
+        return np.array(rows, dtype=np.float64).reshape(len(rows), -1), kept
+
+def build_prediction_response(patient_id, timestamp, features, ulceration_risk,
+                              timeframe_predictions, recommendations):
+    """
+    Assemble the /predict response payload for one patient from its FeatureVector
+    """
+    response = {
+        'patient_id': patient_id,
+        'timestamp': timestamp,
+        'risk_assessment': {
+            'current_ulceration_risk': ulceration_risk,
+            'risk_level': risk_level_label(ulceration_risk),
+            'confidence': 0.85  # This would come from model uncertainty in production
+        },
+        'feature_analysis': {
+            'neurotouch_score': features.get('overall_neuropathy_score', 0),
+            'pressure_analysis': {
+                'max_pressure': features.get('max_pressure', 0),
+                'high_pressure_percentage': features.get('high_pressure_percentage', 0)
+            },
+            'vascular_analysis': {
+                'abi_average': features.get('abi_average', 1.0),
+                'tbi_average': features.get('tbi_average', 1.0),
+                'vascular_risk_score': features.get('vascular_risk_score', 0)
+            }
+        },
+        'progression_predictions': timeframe_predictions,
+        'recommendations': recommendations
+    }
+
+    # Left / right asymmetry of bilateral pedoscan exams
+    if 'peak_pressure_ratio' in features:
+        response['feature_analysis']['pressure_analysis']['asymmetry'] = {
+            name: features.get(name) for name in ASYMMETRY_FEATURE_NAMES
+        }
+
+    # Trends from the patient's exam history; slopes are null until there is enough history
+    if 'history_exam_count' in features:
+        response['feature_analysis']['trend_analysis'] = {
+            name: features.get(name) for name, _, _ in HISTORY_FEATURES
+        }
+
+    return response
+
+def history_summary(response):
+    """
+    Part of a prediction response kept in the patient's exam history
+    """
+    return {
+        'risk_level': response['risk_assessment']['risk_level'],
+        'feature_analysis': response['feature_analysis']
+    }
+
 class DiabeticFootPredictor:
-    def __init__(self):
-        # Initialize ML models (in production, load pre-trained models)
-        self.ulceration_model = RandomForestClassifier(n_estimators=100, random_state=42)
-        self.progression_model = GradientBoostingRegressor(n_estimators=100, random_state=42)
-        self.scaler = StandardScaler()
-        self.risk_threshold = 0.6
+    def __init__(self, settings=None):
+        settings = settings or config['default']
+
+        # Load the latest trained model; the heuristic score is used when there is none
+        self.ulceration_model = None
+        if settings.MODEL_ENABLED:
+            self.ulceration_model = load_latest_model(settings.MODEL_PATH, settings.MODEL_MMAP_MODE or None)
+        self.progression_engine = ProgressionEngine()
+        self.recommendation_rules = load_recommendation_rules(settings.RECOMMENDATION_RULES_PATH)
+        self.image_pipeline = ImagePipeline(
+            max_workers=settings.IMAGE_WORKERS,
+            max_side=settings.IMAGE_ANALYSIS_MAX_SIDE,
+            target_side=settings.IMAGE_ANALYSIS_TARGET_SIDE,
+            roi_enabled=settings.IMAGE_ROI_ENABLED
+        )
+        self.feature_cache = build_feature_cache(settings)
+        self.recordings_dir = settings.PEDOSCAN_RECORDINGS_DIR
+        self.history = build_history_store(settings)
+        self.modality_limits = ModalityLimiter(
+            parse_limits(settings.MODALITY_CONCURRENCY),
+            settings.MODALITY_WAIT_TIMEOUT
+        )
         
-    def extract_neurotouch_features(self, neurotouch_data):
+    @timed
+    def extract_neurotouch_features(self, neurotouch_data, out=None):
         """
         Extract features from neurotouch data
         Expected format: dict with monofilament, vibration, hot, cold perception data
+        Features are written into out (a FeatureVector) when given
         """
-        features = {}
+        features = out if out is not None else FeatureVector()
         
         # Monofilament features
         mono_data = neurotouch_data.get('monofilament', {})
@@ -63,123 +200,246 @@ class DiabeticFootPredictor:
         ])
         
         return features
+
+    @timed
+    def extract_neurotouch_features_batch(self, neurotouch_payloads, matrix, rows):
+        """
+        extract_neurotouch_features for many exams, writing the given rows of
+        matrix one feature column at a time
+        Returns per payload None, or the exception raised while reading it.
+        """
+        errors = [None] * len(neurotouch_payloads)
+        readings, owners = [], []
+        for k, neurotouch_data in enumerate(neurotouch_payloads):
+            try:
+                mono_data = neurotouch_data.get('monofilament', {})
+                vibration_data = neurotouch_data.get('vibration', {})
+                hot_data = neurotouch_data.get('hot_perception', {})
+                cold_data = neurotouch_data.get('cold_perception', {})
+                readings.append((
+                    mono_data.get('risk_score', 0), mono_data.get('tactile_sensation', 0),
+                    len(mono_data.get('affected_points', [])),
+                    vibration_data.get('risk_score', 0), vibration_data.get('threshold', 0),
+                    len(vibration_data.get('affected_points', [])),
+                    hot_data.get('risk_score', 0), hot_data.get('threshold', 0),
+                    cold_data.get('risk_score', 0), cold_data.get('threshold', 0)
+                ))
+                owners.append(k)
+            except Exception as e:
+                errors[k] = e
+
+        values, owners = reading_array(readings, owners, errors)
+        columns = dict(zip((
+            'mono_risk_score', 'mono_tactile_sensation', 'mono_affected_points',
+            'vibration_risk_score', 'vibration_threshold', 'vibration_affected_points',
+            'hot_risk_score', 'hot_threshold', 'cold_risk_score', 'cold_threshold'
+        ), values.T))
+        columns['overall_neuropathy_score'] = (
+            columns['mono_risk_score'] + columns['vibration_risk_score']
+            + columns['hot_risk_score'] + columns['cold_risk_score']
+        ) / 4
+        matrix.set_columns([rows[k] for k in owners], columns)
+
+        return errors
     
-    def extract_pedoscan_features(self, pedoscan_data):
+    @timed
+    def extract_pedoscan_features(self, pedoscan_data, out=None):
         """
         Extract features from pedoscan pressure data
-        Expected format: 2D array of pressure values in kPa
+        Expected format: 2D array of pressure values in kPa, as nested lists or
+        any binary encoding accepted by pressure_io.as_pressure_matrix
+        Bilateral exams give 'pressure_matrices' ({'left': ..., 'right': ...})
+        instead; both feet are processed as one stack
+        Gait recordings are given as 'pressure_frames' (3D frame stack) or
+        'pressure_file' (.npy file in the recordings directory, memory-mapped),
+        with an optional 'frame_rate' in Hz (default 100)
+        Features are written into out (a FeatureVector) when given
         """
-        pressure_matrix = np.array(pedoscan_data['pressure_matrix'])
-        
-        features = {}
-        
-        # Basic pressure statistics
-        features['max_pressure'] = np.max(pressure_matrix)
-        features['mean_pressure'] = np.mean(pressure_matrix[pressure_matrix > 0])
-        features['pressure_variance'] = np.var(pressure_matrix)
-        features['pressure_std'] = np.std(pressure_matrix)
-        
-        # High pressure region analysis
-        high_pressure_threshold = 200  # kPa
-        high_pressure_mask = pressure_matrix > high_pressure_threshold
-        features['high_pressure_area'] = np.sum(high_pressure_mask)
-        features['high_pressure_percentage'] = features['high_pressure_area'] / np.sum(pressure_matrix > 0) * 100
-        
-        # Regional pressure analysis (divide foot into regions)
-        height, width = pressure_matrix.shape
-        
-        # Forefoot region (top 1/3)
-        forefoot = pressure_matrix[:height//3, :]
-        features['forefoot_max_pressure'] = np.max(forefoot)
-        features['forefoot_mean_pressure'] = np.mean(forefoot[forefoot > 0])
-        
-        # Midfoot region (middle 1/3)
-        midfoot = pressure_matrix[height//3:2*height//3, :]
-        features['midfoot_max_pressure'] = np.max(midfoot)
-        features['midfoot_mean_pressure'] = np.mean(midfoot[midfoot > 0])
-        
-        # Rearfoot region (bottom 1/3)
-        rearfoot = pressure_matrix[2*height//3:, :]
-        features['rearfoot_max_pressure'] = np.max(rearfoot)
-        features['rearfoot_mean_pressure'] = np.mean(rearfoot[rearfoot > 0])
-        
-        # Pressure gradient analysis
-        grad_x = np.gradient(pressure_matrix, axis=1)
-        grad_y = np.gradient(pressure_matrix, axis=0)
-        features['pressure_gradient_magnitude'] = np.mean(np.sqrt(grad_x**2 + grad_y**2))
-        
-        # Center of pressure
-        total_pressure = np.sum(pressure_matrix)
-        if total_pressure > 0:
-            y_coords, x_coords = np.mgrid[0:height, 0:width]
-            features['cop_x'] = np.sum(x_coords * pressure_matrix) / total_pressure
-            features['cop_y'] = np.sum(y_coords * pressure_matrix) / total_pressure
-        else:
-            features['cop_x'] = features['cop_y'] = 0
+        features = out if out is not None else FeatureVector()
+
+        if 'pressure_frames' in pedoscan_data or 'pressure_file' in pedoscan_data:
+            features.update(self.extract_gait_features(pedoscan_data))
+            return features
+
+        if 'pressure_matrices' in pedoscan_data:
+            feet = self.foot_pressure_matrices(pedoscan_data)
+            statistics = pedoscan_statistics_many(list(feet.values()))
+            features.update(bilateral_features(dict(zip(feet, statistics)),
+                                               {side: matrix.shape for side, matrix in feet.items()}))
+            return features
+
+        pressure_matrix = as_pressure_matrix(pedoscan_data['pressure_matrix'])
+        METRICS.observe('dfcare_pressure_matrix_cells', pressure_matrix.size)
+        features.update(pedoscan_statistics(pressure_matrix))
         
         return features
-    
-    def extract_foot_image_features(self, foot_images):
+
+    def foot_pressure_matrices(self, pedoscan_data):
         """
-        Extract features from foot images
-        Expected format: list of base64 encoded images
+        Pressure matrix per foot side of a bilateral exam, in FOOT_SIDES order
         """
-        features = {}
-        
-        # Process each image
-        for i, img_base64 in enumerate(foot_images):
+        matrices = pedoscan_data['pressure_matrices']
+        if not isinstance(matrices, dict) or not matrices:
+            raise ValueError(f'pressure_matrices must map foot sides ({", ".join(FOOT_SIDES)}) to pressure matrices')
+        unknown = sorted(str(side) for side in matrices if side not in FOOT_SIDES)
+        if unknown:
+            raise ValueError(f'Unknown foot sides in pressure_matrices: {", ".join(unknown)}')
+
+        feet = {}
+        for side in FOOT_SIDES:
+            if side in matrices:
+                try:
+                    feet[side] = as_pressure_matrix(matrices[side])
+                except ValueError as e:
+                    raise ValueError(f'{side} foot: {e}') from e
+                METRICS.observe('dfcare_pressure_matrix_cells', feet[side].size)
+        return feet
+
+    @timed
+    def extract_gait_features(self, pedoscan_data):
+        """
+        Extract features from a dynamic pedoscan recording
+        Static features describe the peak-pressure map of the sequence
+        """
+        frame_rate = float(pedoscan_data.get('frame_rate', 100))
+
+        if 'pressure_file' in pedoscan_data:
+            frames = np.load(self.recording_path(pedoscan_data['pressure_file']), mmap_mode='r')
+        else:
+            frames = as_pressure_frames(pedoscan_data['pressure_frames'])
+        if frames.ndim != 3:
+            raise ValueError(f'Expected a (frames, height, width) recording, got shape {frames.shape}')
+        METRICS.observe('dfcare_pressure_matrix_cells', frames.size)
+
+        return gait_sequence_features(frames, frame_rate)
+
+    def recording_path(self, name):
+        """
+        Resolve a recording file name inside the recordings directory
+        """
+        root = os.path.realpath(self.recordings_dir)
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError('pressure_file must be inside the recordings directory')
+        return path
+
+    @timed
+    def extract_pedoscan_features_batch(self, pedoscan_payloads, matrix, rows):
+        """
+        extract_pedoscan_features for many exams, writing the given rows of
+        matrix; pressure matrices of the same grid shape, single or one per
+        foot, are processed as one stack.
+        Returns per payload None, or the exception raised while decoding it.
+        """
+        errors = [None] * len(pedoscan_payloads)
+        outs = [matrix.row(i) for i in rows]
+        matrices = []
+        owners = []  # (payload index, foot side or None) per matrix
+        for i, pedoscan_data in enumerate(pedoscan_payloads):
             try:
-                # Decode base64 image
-                img_data = base64.b64decode(img_base64.split(',')[1])
-                img = Image.open(BytesIO(img_data))
-                img_array = np.array(img)
-                
-                # Convert to grayscale if needed
-                if len(img_array.shape) == 3:
-                    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+                if 'pressure_frames' in pedoscan_data or 'pressure_file' in pedoscan_data:
+                    self.extract_pedoscan_features(pedoscan_data, out=outs[i])
+                elif 'pressure_matrices' in pedoscan_data:
+                    # Every foot is decoded and validated before any is queued,
+                    # so a bad foot leaves nothing of its exam in the stack
+                    feet = self.foot_pressure_matrices(pedoscan_data)
+                    matrices.extend(feet.values())
+                    owners.extend((i, side) for side in feet)
+                elif 'pressure_matrix' in pedoscan_data:
+                    matrices.append(as_pressure_matrix(pedoscan_data['pressure_matrix']))
+                    owners.append((i, None))
+                    METRICS.observe('dfcare_pressure_matrix_cells', matrices[-1].size)
                 else:
-                    gray = img_array
-                
-                # Basic image features
-                features[f'img_{i}_mean_intensity'] = np.mean(gray)
-                features[f'img_{i}_std_intensity'] = np.std(gray)
-                features[f'img_{i}_contrast'] = np.max(gray) - np.min(gray)
-                
-                # Texture analysis using Laplacian
-                laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-                features[f'img_{i}_texture_variance'] = laplacian_var
-                
-                # Edge detection
-                edges = cv2.Canny(gray, 50, 150)
-                features[f'img_{i}_edge_density'] = np.sum(edges > 0) / edges.size
-                
-                # Color analysis (if RGB image)
-                if len(img_array.shape) == 3:
-                    features[f'img_{i}_red_mean'] = np.mean(img_array[:,:,0])
-                    features[f'img_{i}_green_mean'] = np.mean(img_array[:,:,1])
-                    features[f'img_{i}_blue_mean'] = np.mean(img_array[:,:,2])
-                    
-                    # Color temperature indicator
-                    red_ratio = np.mean(img_array[:,:,0]) / (np.mean(img_array[:,:,1]) + np.mean(img_array[:,:,2]) + 1e-8)
-                    features[f'img_{i}_red_ratio'] = red_ratio
-                
+                    self.extract_pedoscan_features(pedoscan_data, out=outs[i])
+            except Exception as e:
+                errors[i] = e
+
+        feet = {}
+        for (i, side), matrix, statistics in zip(owners, matrices, pedoscan_statistics_many(matrices)):
+            if side is None:
+                outs[i].update(statistics)
+            else:
+                foot_statistics, shapes = feet.setdefault(i, ({}, {}))
+                foot_statistics[side] = statistics
+                shapes[side] = matrix.shape
+        for i, (foot_statistics, shapes) in feet.items():
+            try:
+                outs[i].update(bilateral_features(foot_statistics, shapes))
             except Exception as e:
-                print(f"Error processing image {i}: {str(e)}")
-                # Set default values if image processing fails
-                features[f'img_{i}_mean_intensity'] = 0
-                features[f'img_{i}_std_intensity'] = 0
-                features[f'img_{i}_contrast'] = 0
-                features[f'img_{i}_texture_variance'] = 0
-                features[f'img_{i}_edge_density'] = 0
+                errors[i] = e
+
+        return errors
+    
+    @timed
+    def extract_foot_image_features(self, foot_images, out=None):
+        """
+        Extract features from foot images
+        Expected format: list of base64 encoded images (or raw uploaded files)
+        Images are decoded once each and analysed concurrently; only the first
+        MAX_FOOT_IMAGES images are analysed
+        Features are written into out (a FeatureVector) when given
+        """
+        features = out if out is not None else FeatureVector()
+        foot_images = foot_images[:MAX_FOOT_IMAGES]
+        features['image_count'] = len(foot_images)
+        
+        # Process all images on the image worker pool
+        for i, stats in enumerate(self.image_pipeline.analyze_all(foot_images)):
+            self.store_image_features(features, i, stats)
         
         return features
+
+    @timed
+    def extract_foot_image_features_batch(self, image_payloads, matrix, rows):
+        """
+        extract_foot_image_features for many exams, writing the given rows of
+        matrix; the images of every exam go to the image worker pool together
+        Returns per payload None, or the exception raised while reading it.
+        """
+        errors = [None] * len(image_payloads)
+        images, owners = [], []  # owners: (payload index, image index) per image
+        for k, foot_images in enumerate(image_payloads):
+            try:
+                foot_images = foot_images[:MAX_FOOT_IMAGES]
+                matrix.row(rows[k])['image_count'] = len(foot_images)
+            except Exception as e:
+                errors[k] = e
+                continue
+            images.extend(foot_images)
+            owners.extend((k, i) for i in range(len(foot_images)))
+
+        for (k, i), stats in zip(owners, self.image_pipeline.analyze_all(images)):
+            self.store_image_features(matrix.row(rows[k]), i, stats)
+
+        return errors
+
+    def store_image_features(self, features, i, stats):
+        """
+        Write the statistics of image i, or defaults when stats is the exception
+        raised while processing it
+        """
+        if isinstance(stats, Exception):
+            app.logger.warning('Error processing image %d: %s', i, stats)
+            METRICS.inc('dfcare_image_errors_total')
+            # Set default values if image processing fails
+            features[image_feature_name(i, 'mean_intensity')] = 0
+            features[image_feature_name(i, 'std_intensity')] = 0
+            features[image_feature_name(i, 'contrast')] = 0
+            features[image_feature_name(i, 'texture_variance')] = 0
+            features[image_feature_name(i, 'edge_density')] = 0
+            return
+
+        for name, value in stats.items():
+            features[image_feature_name(i, name)] = value
     
-    def extract_arterial_features(self, arterial_data):
+    @timed
+    def extract_arterial_features(self, arterial_data, out=None):
         """
         Extract features from arterial testing data
         Expected format: dict with ABI, TBI, and pressure measurements
+        Features are written into out (a FeatureVector) when given
         """
-        features = {}
+        features = out if out is not None else FeatureVector()
         
         # ABI (Ankle-Brachial Index) features
         abi_data = arterial_data.get('abi', {})
@@ -224,191 +484,715 @@ class DiabeticFootPredictor:
             features['vascular_risk_score'] += 1
         
         return features
+
+    @timed
+    def extract_arterial_features_batch(self, arterial_payloads, matrix, rows):
+        """
+        extract_arterial_features for many exams, writing the given rows of
+        matrix one feature column at a time
+        Returns per payload None, or the exception raised while reading it.
+        """
+        errors = [None] * len(arterial_payloads)
+        readings, owners = [], []
+        for k, arterial_data in enumerate(arterial_payloads):
+            try:
+                abi_data = arterial_data.get('abi', {})
+                tbi_data = arterial_data.get('tbi', {})
+                pressures = arterial_data.get('pressures', {})
+                readings.append((
+                    abi_data.get('right', 1.0), abi_data.get('left', 1.0),
+                    tbi_data.get('right', 1.0), tbi_data.get('left', 1.0),
+                    pressures.get('arm_right', 120), pressures.get('arm_left', 120),
+                    pressures.get('ankle_right', 120), pressures.get('ankle_left', 120),
+                    pressures.get('toe_right', 100), pressures.get('toe_left', 100)
+                ))
+                owners.append(k)
+            except Exception as e:
+                errors[k] = e
+
+        values, owners = reading_array(readings, owners, errors)
+        columns = dict(zip((
+            'abi_right', 'abi_left', 'tbi_right', 'tbi_left',
+            'arm_pressure_right', 'arm_pressure_left', 'ankle_pressure_right', 'ankle_pressure_left',
+            'toe_pressure_right', 'toe_pressure_left'
+        ), values.T))
+        columns['abi_average'] = (columns['abi_right'] + columns['abi_left']) / 2
+        columns['abi_asymmetry'] = np.abs(columns['abi_right'] - columns['abi_left'])
+        columns['tbi_average'] = (columns['tbi_right'] + columns['tbi_left']) / 2
+        columns['tbi_asymmetry'] = np.abs(columns['tbi_right'] - columns['tbi_left'])
+        columns['pressure_gradient_right'] = columns['arm_pressure_right'] - columns['toe_pressure_right']
+        columns['pressure_gradient_left'] = columns['arm_pressure_left'] - columns['toe_pressure_left']
+        columns['vascular_risk_score'] = (
+            2 * (columns['abi_average'] < 0.9) + 2 * (columns['tbi_average'] < 0.7)
+            + (columns['abi_average'] > 1.4)  # Non-compressible vessels
+        )
+        matrix.set_columns([rows[k] for k in owners], columns)
+
+        return errors
     
+    @timed
     def predict_ulceration_risk(self, combined_features):
         """
         Predict ulceration risk based on combined features
+        Uses the trained model when one is loaded, the heuristic score otherwise
+        """
+        if self.ulceration_model is not None:
+            METRICS.inc('dfcare_scored_exams_total', scorer='model')
+            features = as_feature_vector(combined_features)
+            return float(self.ulceration_model.predict_risk(model_feature_matrix(features))[0])
+
+        METRICS.inc('dfcare_scored_exams_total', scorer='heuristic')
+        return self.heuristic_ulceration_risk(combined_features)
+
+    def heuristic_ulceration_risk(self, combined_features):
+        """
+        Rule-based ulceration risk used when no trained model is available
         """
-        # Extract key risk factors
-        risk_factors = [
-            combined_features.get('overall_neuropathy_score', 0),
-            combined_features.get('max_pressure', 0) / 400,  # Normalize pressure
-            combined_features.get('high_pressure_percentage', 0) / 100,
-            combined_features.get('vascular_risk_score', 0) / 4,  # Normalize vascular risk
-            combined_features.get('abi_average', 1.0),
-            combined_features.get('tbi_average', 1.0)
-        ]
+        values = as_feature_vector(combined_features).values
         
         # Simple risk calculation (in production, use trained ML model)
         base_risk = 0.1
         
         # Neuropathy contribution
-        neuropathy_risk = combined_features.get('overall_neuropathy_score', 0) * 0.3
+        neuropathy_risk = values[NEUROPATHY_INDEX] * 0.3
         
         # Pressure contribution
-        pressure_risk = min(combined_features.get('max_pressure', 0) / 400, 1.0) * 0.25
+        pressure_risk = min(values[MAX_PRESSURE_INDEX] / 400, 1.0) * 0.25
         
         # Vascular contribution
-        vascular_risk = combined_features.get('vascular_risk_score', 0) / 4 * 0.2
+        vascular_risk = values[VASCULAR_RISK_INDEX] / 4 * 0.2
         
         # ABI contribution
-        abi_risk = max(0, 0.9 - combined_features.get('abi_average', 1.0)) * 0.15
+        abi_risk = max(0, 0.9 - values[ABI_AVERAGE_INDEX]) * 0.15
         
         # TBI contribution
-        tbi_risk = max(0, 0.7 - combined_features.get('tbi_average', 1.0)) * 0.1
+        tbi_risk = max(0, 0.7 - values[TBI_AVERAGE_INDEX]) * 0.1
         
         total_risk = base_risk + neuropathy_risk + pressure_risk + vascular_risk + abi_risk + tbi_risk
         
-        return min(total_risk, 1.0)
+        return float(min(total_risk, 1.0))
     
     def predict_progression(self, combined_features, timeframe_years):
         """
         Predict disease progression over time
         """
-        current_risk = self.predict_ulceration_risk(combined_features)
-        
-        # Time-based progression factors
-        progression_rates = {
-            'neuropathy': 0.05 * timeframe_years,
-            'deformity': 0.03 * timeframe_years,
-            'pressure': 0.04 * timeframe_years,
-            'vascular': 0.02 * timeframe_years
-        }
-        
-        # Calculate progression for each component
-        progression = {}
-        progression['ulceration_risk'] = min(current_risk * (1 + 0.1 * timeframe_years), 1.0)
-        progression['neuropathy_decline'] = progression_rates['neuropathy'] * combined_features.get('overall_neuropathy_score', 0)
-        progression['pressure_increase'] = progression_rates['pressure'] * combined_features.get('max_pressure', 0)
-        progression['deformity_progression'] = progression_rates['deformity'] * timeframe_years
-        
-        return progression
-    
+        curve = self.predict_progression_curve(combined_features, [timeframe_years])
+        return dict(zip(PROGRESSION_COMPONENTS, curve.values[0, :, 0].tolist()))
+
+    @timed
+    def predict_progression_curve(self, combined_features, horizons=DEFAULT_HORIZONS, current_risk=None):
+        """
+        Predict progression for any number of horizons (in years) in one pass
+        Pass current_risk when it is already known to avoid re-scoring
+        """
+        features = as_feature_vector(combined_features)
+        if current_risk is None:
+            current_risk = self.predict_ulceration_risk(features)
+        neuropathy_slope, pressure_slope = observed_trends(features.values, features.present)
+
+        return self.progression_engine.evaluate(
+            current_risk,
+            features.values[NEUROPATHY_INDEX],
+            features.values[MAX_PRESSURE_INDEX],
+            horizons,
+            neuropathy_slope,
+            pressure_slope
+        )
+
+    @timed
     def generate_recommendations(self, combined_features, risk_level):
         """
-        Generate intervention recommendations based on risk analysis
+        Generate intervention recommendations from the recommendation rules
         """
-        recommendations = []
-        
-        # High neuropathy risk
-        if combined_features.get('overall_neuropathy_score', 0) > 0.6:
-            recommendations.append({
-                'intervention': 'Neuropathy Management',
-                'timing': '3 months',
-                'urgency': 'Critical',
-                'effectiveness': 70,
-                'description': 'Immediate neuropathy assessment and management required'
-            })
-        
-        # High pressure risk
-        if combined_features.get('max_pressure', 0) > 250:
-            recommendations.append({
-                'intervention': 'Pressure Offloading',
-                'timing': '2 months',
-                'urgency': 'Critical',
-                'effectiveness': 90,
-                'description': 'Custom pressure redistributing footwear needed'
-            })
-        
-        # Vascular risk
-        if combined_features.get('vascular_risk_score', 0) > 2:
-            recommendations.append({
-                'intervention': 'Vascular Assessment',
-                'timing': '1 month',
-                'urgency': 'High',
-                'effectiveness': 75,
-                'description': 'Comprehensive vascular evaluation required'
-            })
-        
-        # General recommendations based on risk level
-        if risk_level > 0.6:
-            recommendations.append({
-                'intervention': 'Custom Orthotics',
-                'timing': '6 months',
-                'urgency': 'High',
-                'effectiveness': 85,
-                'description': 'Custom orthotic devices to redistribute pressure'
-            })
-        
-        if risk_level > 0.4:
-            recommendations.append({
-                'intervention': 'Enhanced Monitoring',
-                'timing': 'Immediate',
-                'urgency': 'High',
-                'effectiveness': 60,
-                'description': 'Increased frequency of foot examinations'
-            })
-        
-        return recommendations
+        return self.recommendation_rules.recommend(as_feature_vector(combined_features), risk_level)
+
+    @timed
+    def extract_all_features(self, exam, out=None):
+        """
+        Run every modality extractor over a single exam payload, writing into
+        out (a FeatureVector, e.g. a FeatureMatrix row) or a new FeatureVector
+        Features of payloads seen before are served from the feature cache
+        """
+        features = out if out is not None else FeatureVector()
+
+        self.extract_cached(features, 'neurotouch', exam.get('neurotouch', {}), self.extract_neurotouch_features)
+        pedoscan_data = exam.get('pedoscan', {})
+        if 'pressure_file' in pedoscan_data:
+            # Recording files are read in place; their content is not hashed
+            with self.modality_limits.slot('pedoscan'):
+                self.extract_pedoscan_features(pedoscan_data, out=features)
+        else:
+            self.extract_cached(features, 'pedoscan', pedoscan_data, self.extract_pedoscan_features)
+        self.extract_cached(features, 'foot_images', exam.get('foot_images', []), self.extract_foot_image_features)
+        self.extract_cached(features, 'arterial', exam.get('arterial', {}), self.extract_arterial_features)
+
+        return features
+
+    def apply_history(self, features, patient_id, exam_time):
+        """
+        Load the patient's trend features into features, including the exam
+        being scored when it has an exam_time
+        """
+        if self.history is None or not patient_id:
+            return
+        features.clear('history')
+        features.update(self.history.trend_features(patient_id, exam_time, series_values(features)))
+
+    def record_history(self, entries):
+        """
+        Append scored exams to the patient history; exams without a patient_id
+        or exam_time are not recorded
+        entries: (patient_id, exam_time, features, response) for each exam
+        """
+        if self.history is None:
+            return
+        self.history.record_many([
+            (patient_id, exam_time, series_values(features),
+             response['risk_assessment']['current_ulceration_risk'], history_summary(response))
+            for patient_id, exam_time, features, response in entries
+            if patient_id and exam_time is not None
+        ])
+
+    def extract_cached(self, features, modality, payload, extractor):
+        """
+        Fill one modality of features from the feature cache, or run its extractor
+        (within the modality's concurrency limit) and cache the result
+        """
+        key, block = self.feature_cache.lookup(modality, payload)
+        if block is not None:
+            features.load_block(modality, block)
+            return
+
+        with self.modality_limits.slot(modality):
+            extractor(payload, out=features)
+        self.feature_cache.store(key, features.block(modality))
+
+    def extract_cached_batch(self, matrix, modality, payloads, extractor, errors, cacheable=None):
+        """
+        Fill one modality of every row of matrix whose errors entry is None:
+        cached payloads are loaded, the rest go through one batch extractor call
+        (within the modality's concurrency limit) and are cached. Exceptions are
+        set in errors. cacheable(payload) is False for payloads not to be hashed.
+        """
+        pending = []
+        for i, payload in enumerate(payloads):
+            if errors[i] is not None:
+                continue
+            try:
+                key, block = None, None
+                if cacheable is None or cacheable(payload):
+                    key, block = self.feature_cache.lookup(modality, payload)
+            except Exception as e:
+                errors[i] = e
+                continue
+            if block is not None:
+                matrix.row(i).load_block(modality, block)
+            else:
+                pending.append((i, key))
+        if not pending:
+            return
+
+        with self.modality_limits.slot(modality):
+            pending_errors = extractor([payloads[i] for i, _ in pending], matrix, [i for i, _ in pending])
+        for (i, key), error in zip(pending, pending_errors):
+            if error is not None:
+                errors[i] = error
+            elif key is not None:
+                self.feature_cache.store(key, matrix.row(i).block(modality))
+
+    def warm_up(self, rows=8):
+        """
+        Run the scorers once on default-valued exams, so first-call setup (and
+        the page-in of a memory-mapped model) happens before workers are forked
+        Metrics and model counters are not updated.
+        """
+        features = FEATURE_SCHEMA.new_matrix(rows)
+        if self.ulceration_model is not None:
+            risks = self.ulceration_model.estimator.predict_proba(model_feature_matrix(features))[:, 1]
+        else:
+            risks = np.full(rows, 0.5)
+        feature_arrays = features.columns(SCORING_FEATURES)
+        self.progression_engine.evaluate(risks, feature_arrays['overall_neuropathy_score'],
+                                         feature_arrays['max_pressure'])
+        self.recommendation_rules.evaluate(features.values, risks)
+
+    @timed
+    def predict_ulceration_risk_batch(self, feature_arrays):
+        """
+        Vectorized heuristic_ulceration_risk over stacked feature arrays
+        """
+        base_risk = 0.1
+        neuropathy_risk = feature_arrays['overall_neuropathy_score'] * 0.3
+        pressure_risk = np.minimum(feature_arrays['max_pressure'] / 400, 1.0) * 0.25
+        vascular_risk = feature_arrays['vascular_risk_score'] / 4 * 0.2
+        abi_risk = np.maximum(0, 0.9 - feature_arrays['abi_average']) * 0.15
+        tbi_risk = np.maximum(0, 0.7 - feature_arrays['tbi_average']) * 0.1
+
+        total_risk = base_risk + neuropathy_risk + pressure_risk + vascular_risk + abi_risk + tbi_risk
+
+        return np.minimum(total_risk, 1.0)
+
+    @timed
+    def predict_progression_batch(self, feature_arrays, current_risk, horizons=DEFAULT_HORIZONS):
+        """
+        Vectorized predict_progression for every patient and horizon at once
+        Observed trends are read from the optional 'neuropathy_trend' and
+        'pressure_slope' arrays (NaN where unknown)
+        Returns a ProgressionCurve with one row per patient
+        """
+        return self.progression_engine.evaluate(
+            current_risk,
+            feature_arrays['overall_neuropathy_score'],
+            feature_arrays['max_pressure'],
+            horizons,
+            feature_arrays.get('neuropathy_trend'),
+            feature_arrays.get('pressure_slope')
+        )
+
+    @timed
+    def generate_recommendations_batch(self, features, current_risk):
+        """
+        Vectorized generate_recommendations over a FeatureMatrix: one array
+        comparison per rule condition
+        """
+        return self.recommendation_rules.evaluate(features.values, current_risk)
+
+    @timed
+    def predict_batch(self, exams, curve_horizons=None):
+        """
+        Predict risk, progression and recommendations for many patients
+        Features are extracted one modality at a time for the whole batch;
+        scoring runs in vectorized passes
+        curve_horizons (years) adds a 'progression_curve' series to each result
+        Returns one response dict per exam, or {'patient_id', 'error'} on failure
+        """
+        timestamp = datetime.now().isoformat()
+        results = [None] * len(exams)
+        errors = [None] * len(exams)
+        matrix = FeatureMatrix(len(exams))
+
+        # Cached payloads are loaded, the rest of each modality is extracted in
+        # one batch (pedoscan in stacks of same-shape pressure matrices)
+        self.extract_cached_batch(matrix, 'pedoscan', [exam.get('pedoscan', {}) for exam in exams],
+                                  self.extract_pedoscan_features_batch, errors,
+                                  cacheable=lambda pedoscan_data: 'pressure_file' not in pedoscan_data)
+        self.extract_cached_batch(matrix, 'neurotouch', [exam.get('neurotouch', {}) for exam in exams],
+                                  self.extract_neurotouch_features_batch, errors)
+        self.extract_cached_batch(matrix, 'foot_images', [exam.get('foot_images', []) for exam in exams],
+                                  self.extract_foot_image_features_batch, errors)
+        self.extract_cached_batch(matrix, 'arterial', [exam.get('arterial', {}) for exam in exams],
+                                  self.extract_arterial_features_batch, errors)
+
+        extracted = []
+        exam_times = [None] * len(exams)
+        for i, exam in enumerate(exams):
+            try:
+                if errors[i] is not None:
+                    raise errors[i]
+                exam_times[i] = parse_exam_time(exam.get('exam_date'))
+                self.apply_history(matrix.row(i), exam.get('patient_id'), exam_times[i])
+                extracted.append(i)
+            except ServiceOverloaded:
+                raise
+            except Exception as e:
+                results[i] = {'patient_id': exam.get('patient_id'), 'error': str(e)}
+
+        if not extracted:
+            return results
+
+        features = matrix.take(extracted)
+        feature_arrays = features.columns(SCORING_FEATURES)
+        feature_arrays['neuropathy_trend'], feature_arrays['pressure_slope'] = \
+            observed_trends(features.values, features.present)
+
+        if self.ulceration_model is not None:
+            risks = self.ulceration_model.predict_risk(model_feature_matrix(features))
+        else:
+            risks = self.predict_ulceration_risk_batch(feature_arrays)
+        METRICS.inc('dfcare_scored_exams_total', len(extracted),
+                    scorer='model' if self.ulceration_model is not None else 'heuristic')
+        progression = self.predict_progression_batch(feature_arrays, risks)
+        curves = None
+        if curve_horizons is not None:
+            curves = self.predict_progression_batch(feature_arrays, risks, curve_horizons)
+        recommendations = self.generate_recommendations_batch(features, risks)
+
+        for row, i in enumerate(extracted):
+            results[i] = build_prediction_response(
+                exams[i].get('patient_id'), timestamp, features.row(row),
+                float(risks[row]), progression.to_dict(row), recommendations[row]
+            )
+            if curves is not None:
+                results[i]['progression_curve'] = curves.to_series(row)
+
+        self.record_history([
+            (exams[i].get('patient_id'), exam_times[i], features.row(row), results[i])
+            for row, i in enumerate(extracted)
+        ])
+
+        return results
 
 # Initialize predictor
-predictor = DiabeticFootPredictor()
+predictor = DiabeticFootPredictor(app_config)
+if predictor.ulceration_model is not None:
+    app.logger.info('Loaded ulceration model %s in %.1f ms',
+                    predictor.ulceration_model.version, predictor.ulceration_model.load_seconds * 1000)
+job_runner = build_job_runner(app_config)
+response_encoder = ResponseEncoder(
+    app_config.RESPONSE_COMPRESS_MIN_BYTES,
+    app_config.RESPONSE_GZIP_LEVEL,
+    app_config.RESPONSE_BROTLI_QUALITY
+)
+METRICS.configure(app_config.METRICS_DIR, app_config.METRICS_FLUSH_INTERVAL)
+
+@app.before_request
+def start_request_metrics():
+    METRICS.ensure_flusher()
+    g.request_start = time.perf_counter()
+    if request.content_length:
+        METRICS.observe('dfcare_payload_bytes', request.content_length, kind='request')
+
+    # Per-request sampling profile: ?profile=1 or an X-Profile: 1 header
+    if app_config.PROFILING_ENABLED and (request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'):
+        g.profiler = SamplingProfiler(app_config.PROFILE_INTERVAL).start()
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    start = g.get('request_start')
+    if start is not None:
+        METRICS.observe('dfcare_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+    METRICS.inc('dfcare_requests_total', endpoint=endpoint, status=str(response.status_code))
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        path = profiler.stop().write(app_config.PROFILE_DIR, endpoint)
+        response.headers['X-Profile-File'] = os.path.basename(path)
+    return response
+
+def overloaded_response(error):
+    """
+    429 / 503 response with a Retry-After hint for a ServiceOverloaded error
+    """
+    METRICS.inc('dfcare_overloaded_total', status=str(error.status))
+    response = jsonify({'error': str(error)})
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
+def parse_exam_request():
+    """
+    Read one exam from the request body
+    JSON bodies are used as-is and msgpack bodies may carry binary pressure
+    matrices. multipart/form-data uploads carry the exam JSON in the 'exam' field,
+    the foot images as file parts named 'foot_images' and optionally a binary
+    'pressure_matrix' part, or 'pressure_matrix_left' / 'pressure_matrix_right'
+    parts for a bilateral exam; files are streamed to disk as they arrive instead of
+    being inlined as base64.
+    """
+    if request.mimetype in MSGPACK_CONTENT_TYPES:
+        return unpack_msgpack(request.get_data())
+
+    if request.mimetype == 'multipart/form-data':
+        exam = json.loads(request.form.get('exam', '{}'))
+        image_files = request.files.getlist('foot_images')
+        if image_files:
+            exam['foot_images'] = image_files
+        pressure_file = request.files.get('pressure_matrix')
+        if pressure_file is not None:
+            exam.setdefault('pedoscan', {})['pressure_matrix'] = pressure_file.read()
+        for side in FOOT_SIDES:
+            pressure_file = request.files.get(f'pressure_matrix_{side}')
+            if pressure_file is not None:
+                pedoscan_data = exam.setdefault('pedoscan', {})
+                pedoscan_data.setdefault('pressure_matrices', {})[side] = pressure_file.read()
+        return exam
+
+    return request.json
+
+def requested_curve_horizons():
+    """
+    Monthly progression grid requested with ?curve_months=N, or None
+    """
+    months = request.args.get('curve_months', type=int)
+    if not months:
+        return None
+    return monthly_horizons(min(max(months, 1), MAX_CURVE_MONTHS))
+
+def requested_fields():
+    """
+    Field paths requested with ?fields=a,b.c, or None for the full response
+    """
+    return parse_fields(request.args.get('fields'))
+
+def select_response_fields(payload, paths):
+    """
+    Apply a ?fields= selection to a /predict response, or to each result of a
+    /predict/batch response
+    """
+    if paths is None or not isinstance(payload, dict):
+        return payload
+    if 'results' in payload:
+        return dict(payload, results=[select_fields(result, paths) for result in payload['results']])
+    return select_fields(payload, paths)
+
+def encoded_response(payload, status=200):
+    """
+    Predict endpoint response in the format and compression negotiated
+    through Accept and Accept-Encoding
+    """
+    with stage('serialize_response'):
+        body, headers = response_encoder.encode(payload, request.accept_mimetypes, request.accept_encodings)
+    METRICS.observe('dfcare_payload_bytes', len(body), kind='response')
+    return Response(body, status=status, headers=headers)
+
+def run_prediction(data, curve_horizons=None):
+    """
+    Full /predict response for one parsed exam
+    curve_horizons (years) adds a dense 'progression_curve' series
+    """
+    # Extract features from all input modalities into one feature vector
+    exam_time = parse_exam_time(data.get('exam_date'))
+    combined_features = predictor.extract_all_features(data)
+    
+    # Add trends from the patient's earlier exams
+    predictor.apply_history(combined_features, data.get('patient_id'), exam_time)
+    
+    # Predict ulceration risk
+    ulceration_risk = predictor.predict_ulceration_risk(combined_features)
+    
+    # Generate predictions for all timeframes in one pass
+    progression = predictor.predict_progression_curve(combined_features, current_risk=ulceration_risk)
+    timeframe_predictions = progression.to_dict()
+    
+    # Generate recommendations
+    recommendations = predictor.generate_recommendations(combined_features, ulceration_risk)
+    
+    # Prepare response
+    response = build_prediction_response(
+        data.get('patient_id'), datetime.now().isoformat(), combined_features,
+        ulceration_risk, timeframe_predictions, recommendations
+    )
+
+    # Optional dense monthly curve for the dashboard charts
+    if curve_horizons is not None:
+        response['progression_curve'] = predictor.predict_progression_curve(
+            combined_features, curve_horizons, current_risk=ulceration_risk
+        ).to_series()
+    
+    predictor.record_history([(data.get('patient_id'), exam_time, combined_features, response)])
+    
+    return response
+
+def run_batch_prediction(exams, curve_horizons=None):
+    """
+    Full /predict/batch response for a list of parsed exams
+    """
+    results = predictor.predict_batch(exams, curve_horizons=curve_horizons)
+    return {'count': len(results), 'results': results}
+
+def batch_exams(data):
+    """
+    Exam list of a batch body ({"exams": [...]} or a bare list), or None for a single exam
+    """
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict) and 'exams' in data:
+        return data['exams']
+    return None
+
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
-        data = request.json
+        with stage('parse_request'):
+            data = parse_exam_request()
         
-        # Extract features from all input modalities
-        neurotouch_features = predictor.extract_neurotouch_features(data.get('neurotouch', {}))
-        pedoscan_features = predictor.extract_pedoscan_features(data.get('pedoscan', {}))
-        image_features = predictor.extract_foot_image_features(data.get('foot_images', []))
-        arterial_features = predictor.extract_arterial_features(data.get('arterial', {}))
+        response = run_prediction(data, requested_curve_horizons())
         
-        # Combine all features
-        combined_features = {
-            **neurotouch_features,
-            **pedoscan_features,
-            **image_features,
-            **arterial_features
-        }
-        
-        # Predict ulceration risk
-        ulceration_risk = predictor.predict_ulceration_risk(combined_features)
-        
-        # Generate predictions for different timeframes
-        timeframe_predictions = {}
-        for years in [1, 2, 3, 5, 10]:
-            progression = predictor.predict_progression(combined_features, years)
-            timeframe_predictions[f'year_{years}'] = progression
-        
-        # Generate recommendations
-        recommendations = predictor.generate_recommendations(combined_features, ulceration_risk)
-        
-        # Prepare response
-        response = {
-            'patient_id': data.get('patient_id'),
-            'timestamp': datetime.now().isoformat(),
-            'risk_assessment': {
-                'current_ulceration_risk': ulceration_risk,
-                'risk_level': 'Low' if ulceration_risk < 0.3 else 'Moderate' if ulceration_risk < 0.6 else 'High',
-                'confidence': 0.85  # This would come from model uncertainty in production
-            },
-            'feature_analysis': {
-                'neurotouch_score': neurotouch_features.get('overall_neuropathy_score', 0),
-                'pressure_analysis': {
-                    'max_pressure': pedoscan_features.get('max_pressure', 0),
-                    'high_pressure_percentage': pedoscan_features.get('high_pressure_percentage', 0)
-                },
-                'vascular_analysis': {
-                    'abi_average': arterial_features.get('abi_average', 1.0),
-                    'tbi_average': arterial_features.get('tbi_average', 1.0),
-                    'vascular_risk_score': arterial_features.get('vascular_risk_score', 0)
-                }
-            },
-            'progression_predictions': timeframe_predictions,
-            'recommendations': recommendations
-        }
+        return encoded_response(select_response_fields(response, requested_fields()))
         
+    except ServiceOverloaded as e:
+        return overloaded_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    Score many exams in one request
+    Body: {"exams": [<exam>, ...]} or a bare list of exams, each in the /predict format
+    """
+    try:
+        with stage('parse_request'):
+            exams = batch_exams(request.json) or []
+        if not isinstance(exams, list):
+            return jsonify({'error': 'exams must be a list'}), 400
+
+        response = run_batch_prediction(exams, requested_curve_horizons())
+
+        return encoded_response(select_response_fields(response, requested_fields()))
+
+    except ServiceOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/predict/jobs', methods=['POST'])
+def submit_prediction_job():
+    """
+    Run a prediction in the background instead of holding the connection open
+    Body: one exam in any /predict format, or a /predict/batch body
+    Returns 202 with the job id; poll GET /predict/jobs/<job_id> for the result
+    """
+    try:
+        data = parse_exam_request()
+        curve_horizons = requested_curve_horizons()
+
+        exams = batch_exams(data)
+        if exams is not None:
+            if not isinstance(exams, list):
+                return jsonify({'error': 'exams must be a list'}), 400
+            job_id = job_runner.submit('batch', run_batch_prediction, exams, curve_horizons)
+        else:
+            # Uploaded files are closed when this request ends; keep their content
+            images = data.get('foot_images')
+            if images:
+                data['foot_images'] = [image.read() if hasattr(image, 'read') else image for image in images]
+            job_id = job_runner.submit('predict', run_prediction, data, curve_horizons)
+
+        status_url = url_for('get_prediction_job', job_id=job_id)
+        response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url})
+        response.status_code = 202
+        response.headers['Location'] = status_url
+        return response
+
+    except ServiceOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/predict/jobs/<job_id>', methods=['GET'])
+def get_prediction_job(job_id):
+    """
+    Status of a prediction job; finished jobs include their 'result' (the
+    /predict or /predict/batch response) or 'error' until the result TTL expires
+    """
+    job = job_runner.store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.get('result') is not None:
+        job['result'] = select_response_fields(job['result'], requested_fields())
+    return encoded_response(job)
+
+@app.route('/patients/<patient_id>/history', methods=['GET'])
+def patient_history(patient_id):
+    """
+    A patient's recorded exams, newest first, with their current trend features
+    Query: limit (default 50), cursor (next_cursor of the previous page)
+    """
+    if predictor.history is None:
+        return jsonify({'error': 'Patient history is disabled'}), 404
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_HISTORY_PAGE)
+        exams, next_cursor = predictor.history.history(patient_id, limit, request.args.get('cursor'))
+
+        return jsonify({
+            'patient_id': patient_id,
+            'trends': predictor.history.trend_features(patient_id),
+            'exams': exams,
+            'next_cursor': next_cursor
+        })
+
+    except ValueError as e:
+        return jsonify({'error': f'Invalid cursor: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/pedoscan/analyze', methods=['POST'])
+def analyze_pedoscan():
+    """
+    Pedoscan features for one pressure matrix uploaded as the request body
+    Content-Type: application/x-pressure-f32 (raw float32 with shape header),
+    application/x-npy, or application/json in the /predict pedoscan format
+    """
+    try:
+        if request.is_json:
+            pedoscan_data = request.json
+        else:
+            pedoscan_data = {'pressure_matrix': decode_bytes(request.get_data())}
+
+        with predictor.modality_limits.slot('pedoscan'):
+            features = predictor.extract_pedoscan_features(pedoscan_data)
+
+        return jsonify(features.to_dict())
+
+    except ServiceOverloaded as e:
+        return overloaded_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/pedoscan/stream', methods=['POST'])
+def stream_pedoscan():
+    """
+    Gait features for a pressure frame sequence streamed as the request body
+    Body: application/x-pressure-f32 frame stream (uint32 height, uint32 width,
+    then float32 frames), read in bounded chunks as it arrives
+    Query: frame_rate (Hz, default 100), curves=1 to include per-frame curves
+    """
+    try:
+        frame_rate = request.args.get('frame_rate', 100, type=float)
+        accumulator = None
+        for frames in iter_raw_frames(request.stream):
+            if accumulator is None:
+                accumulator = GaitSequenceAccumulator(frames.shape[1:], frame_rate)
+            accumulator.update(frames)
+        if accumulator is None:
+            raise ValueError('No pressure frames received')
+
+        response = {'features': accumulator.features()}
+        if request.args.get('curves', type=int):
+            response['curves'] = accumulator.curves()
+
         return jsonify(response)
-        
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Feature cache hit / miss counters for this worker process
+    """
+    return jsonify(predictor.feature_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus metrics merged across all worker processes
+    """
+    return Response(render_prometheus(METRICS.collect()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/model/info', methods=['GET'])
+def model_info():
+    """
+    Loaded model version with its load and per-batch inference timings
+    """
+    model = predictor.ulceration_model
+    return jsonify({
+        'scoring': 'model' if model is not None else 'heuristic',
+        'model': model.info() if model is not None else None
+    })
+
 @app.route('/data-format', methods=['GET'])
 def get_data_format():
     """
@@ -443,15 +1227,38 @@ def get_data_format():
             'format': {
                 'pressure_matrix': '2D array of pressure values in kPa',
                 'example_size': '64x32 or similar grid',
-                'units': 'kPa'
+                'units': 'kPa',
+                'bilateral': {
+                    'pressure_matrices': '{"left": matrix, "right": matrix} in any of the encodings below, instead of pressure_matrix',
+                    'features': 'left_* and right_* statistics per foot; the unprefixed statistics are those of the foot with the highest peak pressure',
+                    'asymmetry': 'peak_pressure_ratio (higher over lower peak), peak_pressure_asymmetry (%), cop_offset_x / cop_offset_y (right minus left, fraction of the grid)',
+                    'multipart': '"pressure_matrix_left" and "pressure_matrix_right" file parts'
+                },
+                'binary_encodings': {
+                    'json': '{"shape": [h, w], "dtype": "<f4", "data": "<base64>"} in place of the nested lists',
+                    'msgpack': 'POST /predict as application/msgpack with data as a bin payload',
+                    'multipart': 'a "pressure_matrix" file part in raw or .npy format',
+                    'raw': 'application/x-pressure-f32: uint32 height, uint32 width (little-endian), then float32 values',
+                    'npy': 'application/x-npy: a NumPy .npy file'
+                },
+                'upload': 'POST /pedoscan/analyze with a raw or .npy body returns pedoscan features only',
+                'gait': {
+                    'pressure_frames': '3D array (frames x height x width) in any of the encodings above, instead of pressure_matrix',
+                    'pressure_file': 'name of a .npy recording in the recordings directory, memory-mapped',
+                    'frame_rate': 'float (Hz), default 100',
+                    'stream': 'POST /pedoscan/stream with a raw float32 frame stream body'
+                }
             }
         },
         'foot_images': {
             'description': 'Foot images for visual analysis',
             'format': {
                 'images': 'list of base64 encoded images',
-                'count': '5 images recommended',
-                'format': 'base64 string with data:image/jpeg;base64, prefix'
+                'count': f'5 images recommended, at most {MAX_FOOT_IMAGES} are analysed',
+                'format': 'base64 string with data:image/jpeg;base64, prefix',
+                'framing': 'plantar view of one foot on a plain background; the foot is located and cropped automatically',
+                'upload': 'alternatively POST multipart/form-data with the exam JSON in an "exam" field and one "foot_images" file part per image',
+                'large_uploads': 'POST many or high-resolution images to /predict/jobs and poll GET /predict/jobs/<job_id> for the result'
             }
         },
         'arterial': {
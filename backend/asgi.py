@@ -0,0 +1,295 @@
+"""
+Optional ASGI serving mode with request queueing and backpressure
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    python asgi.py
+
+The Flask app is served from an event loop that only reads request bodies and
+writes responses. Heavy requests (POST /predict, /predict/batch, /pedoscan/*)
+pass through an AdmissionController and run on a bounded thread pool, so a
+saturated server answers new ones with 429 (queue full) or 503 (queue wait timed
+out) plus Retry-After instead of leaving sockets hanging. Cheap routes such as
+/health and /data-format run on a separate small pool and stay responsive.
+
+Request bodies are read in full before the WSGI app runs, except on streaming
+routes (POST /pedoscan/stream), whose body is passed to the app as a
+wsgi.input that pulls the next chunk from the client as the app reads it, so
+the route still processes its body in bounded chunks as it arrives. A client
+that disconnects before sending its whole body gets no response and its
+request is not processed.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from admission import AdmissionController, ServiceOverloaded
+from metrics import METRICS
+from app import app, app_config, predictor
+
+# Routes answered on the light pool whatever their method
+LIGHT_PATHS = ('/health', '/data-format', '/cache/stats', '/model/info', '/metrics')
+ADMISSION_STATS_PATH = '/admission/stats'
+# Routes whose body is streamed to the app as it arrives instead of read up front
+STREAMING_PATHS = ('/pedoscan/stream',)
+
+def wsgi_environ(scope, body):
+    """
+    WSGI environ for an ASGI http scope and its complete body (bytes) or a
+    StreamingBody
+    """
+    streaming = isinstance(body, StreamingBody)
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body if streaming else BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if streaming:
+        # The stream ends with the request body, chunked or not
+        environ['wsgi.input_terminated'] = True
+    else:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_LENGTH' and not streaming:
+            continue
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def call_wsgi(wsgi_app, environ):
+    """
+    Run a WSGI app to completion; returns (status, headers, body)
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+class BodyTooLarge(Exception):
+    pass
+
+class ClientDisconnected(Exception):
+    pass
+
+class StreamingBody(io.RawIOBase):
+    """
+    wsgi.input of a streaming route: reads, made from the WSGI app's thread,
+    pull the next body messages from the ASGI receive channel on the event loop,
+    so at most one message is buffered beyond what the app has read. Raises
+    ClientDisconnected when the client goes away before the end of the body
+    and BodyTooLarge past max_bytes; the error is kept in self.error.
+    """
+    def __init__(self, receive, loop, max_bytes):
+        self.receive = receive
+        self.loop = loop
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.finished = False
+        self.error = None
+        self._buffer = bytearray()
+
+    def readable(self):
+        return True
+
+    def _pull(self):
+        if self.error is not None:
+            raise self.error
+        message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+        if message['type'] == 'http.disconnect':
+            self.error = ClientDisconnected('Client disconnected before the end of the request body')
+            raise self.error
+        chunk = message.get('body', b'')
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.error = BodyTooLarge(f'Request body exceeds {self.max_bytes} bytes')
+            raise self.error
+        self._buffer += chunk
+        self.finished = not message.get('more_body', False)
+
+    def readinto(self, buffer):
+        # Fill the whole buffer unless the body ends first, like a socket file
+        while len(self._buffer) < len(buffer) and not self.finished:
+            self._pull()
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+class AsyncServer:
+    """
+    ASGI application wrapping a WSGI app with admission control
+    """
+    def __init__(self, wsgi_app, settings, modality_limits=None):
+        self.wsgi_app = wsgi_app
+        self.modality_limits = modality_limits
+        self.max_body_bytes = settings.ASGI_MAX_BODY_BYTES
+        self.admission = AdmissionController(
+            max_concurrency=settings.ADMISSION_MAX_CONCURRENCY,
+            max_queue=settings.ADMISSION_MAX_QUEUE,
+            queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+            retry_after=settings.ADMISSION_RETRY_AFTER
+        )
+        self.heavy_executor = ThreadPoolExecutor(max_workers=settings.ADMISSION_MAX_CONCURRENCY,
+                                                 thread_name_prefix='predict')
+        self.light_executor = ThreadPoolExecutor(max_workers=settings.ASGI_LIGHT_WORKERS,
+                                                 thread_name_prefix='light')
+
+    def is_light(self, scope):
+        return scope['path'] in LIGHT_PATHS or scope['method'] in ('GET', 'HEAD', 'OPTIONS')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if scope['path'] == ADMISSION_STATS_PATH:
+            await self.send_json(send, 200, self.stats())
+            return
+
+        if self.is_light(scope):
+            try:
+                body = await self.read_body(scope, receive)
+            except BodyTooLarge as e:
+                await self.send_json(send, 413, {'error': str(e)})
+                return
+            except ClientDisconnected:
+                return
+            await self.run(self.light_executor, scope, body, send)
+            return
+
+        acquired = False
+        try:
+            # Reject before reading the body when the queue is already full
+            self.admission.reserve()
+        except ServiceOverloaded as e:
+            await self.send_overloaded(send, e)
+            return
+        try:
+            if scope['path'] in STREAMING_PATHS:
+                self.check_content_length(scope)
+                await self.admission.acquire()
+                acquired = True
+                body = StreamingBody(receive, asyncio.get_running_loop(), self.max_body_bytes)
+            else:
+                body = await self.read_body(scope, receive)
+                await self.admission.acquire()
+                acquired = True
+            await self.run(self.heavy_executor, scope, body, send)
+        except ServiceOverloaded as e:
+            await self.send_overloaded(send, e)
+        except BodyTooLarge as e:
+            await self.send_json(send, 413, {'error': str(e)})
+        except ClientDisconnected:
+            pass
+        finally:
+            self.admission.release(acquired)
+
+    def stats(self):
+        stats = {'pid': os.getpid(), 'admission': self.admission.stats()}
+        if self.modality_limits is not None:
+            stats['modalities'] = self.modality_limits.stats()
+        return stats
+
+    async def run(self, executor, scope, body, send):
+        loop = asyncio.get_running_loop()
+        status, headers, payload = await loop.run_in_executor(
+            executor, call_wsgi, self.wsgi_app, wsgi_environ(scope, body))
+        # A streamed body that failed part way was not processed, whatever the app answered
+        if isinstance(body, StreamingBody) and body.error is not None:
+            raise body.error
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+    def check_content_length(self, scope):
+        for name, value in scope.get('headers', []):
+            if name == b'content-length' and int(value) > self.max_body_bytes:
+                raise BodyTooLarge(f'Request body exceeds {self.max_body_bytes} bytes')
+
+    async def read_body(self, scope, receive):
+        self.check_content_length(scope)
+
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected('Client disconnected before the end of the request body')
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                raise BodyTooLarge(f'Request body exceeds {self.max_body_bytes} bytes')
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    async def send_json(self, send, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode())] + list(headers)
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def send_overloaded(self, send, error):
+        METRICS.inc('dfcare_overloaded_total', status=str(error.status))
+        await self.send_json(send, error.status, {'error': str(error)},
+                             [(b'retry-after', str(error.retry_after).encode())])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.heavy_executor.shutdown(wait=True)
+                self.light_executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+application = AsyncServer(app, app_config, predictor.modality_limits)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(
+        'asgi:application',
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', 5000)),
+        workers=int(os.environ.get('ASGI_WORKERS', 4))
+    )
@@ -0,0 +1,9 @@
+"""
+Benchmark suite for the prediction pipeline
+
+    python -m benchmarks run [--output results.json] [--concurrency 1,4,8]
+    python -m benchmarks compare baseline.json results.json
+
+Run from the backend directory. Results are JSON so runs on different commits
+can be compared.
+"""
@@ -0,0 +1,70 @@
+import argparse
+import json
+import sys
+
+from benchmarks.synthetic import IMAGE_RESOLUTIONS, PEDOSCAN_SHAPES
+
+def int_list(value):
+    return tuple(int(item) for item in value.split(','))
+
+def str_list(value):
+    return tuple(item for item in value.split(',') if item)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Prediction pipeline benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the benchmarks and write a JSON report')
+    run.add_argument('--output', '-o', help='report file (default: stdout)')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--suite', choices=('all', 'micro', 'e2e'), default='all')
+    run.add_argument('--repeat', type=int, default=50, help='calls per micro-benchmark')
+    run.add_argument('--image-counts', type=int_list, default=(1, 5, 10))
+    run.add_argument('--image-resolutions', type=str_list, default=('vga', 'hd'),
+                     help=f'comma-separated, from {", ".join(IMAGE_RESOLUTIONS)}')
+    run.add_argument('--requests', type=int, default=200, help='end-to-end requests per concurrency level')
+    run.add_argument('--concurrency', type=int_list, default=(1, 4))
+    run.add_argument('--pedoscan-shape', choices=tuple(PEDOSCAN_SHAPES), default='64x32')
+    run.add_argument('--images', type=int, default=5, help='images per end-to-end exam')
+    run.add_argument('--resolution', choices=tuple(IMAGE_RESOLUTIONS), default='vga')
+
+    compare = commands.add_parser('compare', help='compare two reports')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--metric', default='p50_ms', choices=('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'))
+    compare.add_argument('--threshold', type=float, default=0.1,
+                         help='fractional slowdown reported as a regression (exit status 1)')
+
+    args = parser.parse_args(argv)
+
+    # Imported here so that 'compare' does not load the application
+    from benchmarks.suite import compare_reports, run_suite
+
+    if args.command == 'run':
+        report = run_suite(
+            seed=args.seed, repeat=args.repeat, image_counts=args.image_counts,
+            image_resolutions=args.image_resolutions, requests=args.requests,
+            concurrency=args.concurrency, pedoscan_shape=args.pedoscan_shape,
+            image_count=args.images, image_resolution=args.resolution,
+            micro=args.suite in ('all', 'micro'), end_to_end=args.suite in ('all', 'e2e')
+        )
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows, regressions = compare_reports(baseline, current, args.metric, args.threshold)
+    for section, name, params, before, after, ratio in rows:
+        flag = '  REGRESSION' if ratio > 1 + args.threshold else ''
+        print(f'{section:10} {name:32} {json.dumps(params):60} {before:10.3f} -> {after:10.3f} ms  x{ratio:.2f}{flag}')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Micro-benchmarks of the extractors and end-to-end /predict load runs
+
+The feature cache is disabled so that repeated payloads measure extraction,
+not cache hits, and benchmark exams are not recorded in the patient history.
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+os.environ.setdefault('FEATURE_CACHE_BACKEND', 'none')
+os.environ.setdefault('METRICS_DIR', '')
+os.environ.setdefault('HISTORY_ENABLED', 'false')
+
+from benchmarks.synthetic import ExamGenerator, PEDOSCAN_SHAPES
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def summarize(name, params, latencies, wall_seconds=None):
+    """
+    Result record for a list of per-call latencies in seconds
+    """
+    latencies_ms = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    wall_seconds = wall_seconds if wall_seconds is not None else float(np.sum(latencies))
+    return {
+        'name': name,
+        'params': params,
+        'samples': len(latencies),
+        'mean_ms': float(latencies_ms.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'throughput_per_s': len(latencies) / wall_seconds if wall_seconds else 0.0
+    }
+
+def time_calls(func, payloads, warmup=3):
+    """
+    Per-call latencies of func over payloads, after a few warm-up calls
+    """
+    for payload in payloads[:warmup]:
+        func(payload)
+    latencies = []
+    for payload in payloads:
+        start = time.perf_counter()
+        func(payload)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def run_micro(predictor, generator, repeat=50, image_counts=(1, 5, 10), image_resolutions=('vga', 'hd')):
+    results = []
+
+    payloads = [generator.neurotouch() for _ in range(repeat)]
+    results.append(summarize('extract_neurotouch_features', {},
+                             time_calls(predictor.extract_neurotouch_features, payloads)))
+
+    for label, shape in PEDOSCAN_SHAPES.items():
+        payloads = [{'pressure_matrix': generator.pressure_matrix(shape).tolist()} for _ in range(repeat)]
+        results.append(summarize('extract_pedoscan_features', {'shape': label},
+                                 time_calls(predictor.extract_pedoscan_features, payloads)))
+
+    frames = np.stack([generator.pressure_matrix((64, 32)) for _ in range(100)])
+    payloads = [{'pressure_frames': frames, 'frame_rate': 100}] * max(5, repeat // 5)
+    results.append(summarize('extract_gait_features', {'shape': '64x32', 'frames': 100},
+                             time_calls(predictor.extract_gait_features, payloads)))
+
+    for resolution in image_resolutions:
+        for count in image_counts:
+            payloads = [generator.foot_images(count, resolution)] * max(5, repeat // 10)
+            results.append(summarize('extract_foot_image_features', {'images': count, 'resolution': resolution},
+                                     time_calls(predictor.extract_foot_image_features, payloads, warmup=1)))
+
+    payloads = [generator.arterial() for _ in range(repeat)]
+    results.append(summarize('extract_arterial_features', {},
+                             time_calls(predictor.extract_arterial_features, payloads)))
+
+    features = [predictor.extract_all_features(generator.exam(image_count=0)) for _ in range(repeat)]
+    results.append(summarize('predict_ulceration_risk', {},
+                             time_calls(predictor.predict_ulceration_risk, features)))
+    results.append(summarize('predict_progression_curve', {},
+                             time_calls(predictor.predict_progression_curve, features)))
+    risks = [predictor.predict_ulceration_risk(f) for f in features]
+    results.append(summarize('generate_recommendations', {},
+                             time_calls(lambda args: predictor.generate_recommendations(*args),
+                                        list(zip(features, risks)))))
+
+    return results
+
+def run_end_to_end(app, generator, requests=200, concurrency=(1, 4), pedoscan_shape='64x32',
+                   image_count=5, image_resolution='vga'):
+    """
+    POST /predict through the Flask test client from concurrency threads
+    """
+    bodies = [
+        json.dumps(generator.exam(f'bench-{i}', PEDOSCAN_SHAPES[pedoscan_shape], image_count, image_resolution))
+        for i in range(min(requests, 50))
+    ]
+    params = {'pedoscan_shape': pedoscan_shape, 'images': image_count, 'resolution': image_resolution}
+
+    def post(i):
+        # One client per call: the test client is not shared between threads
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post('/predict', data=bodies[i % len(bodies)], content_type='application/json')
+        return time.perf_counter() - start, response.status_code
+
+    post(0)
+    results = []
+    for workers in concurrency:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(post, range(requests)))
+        wall_seconds = time.perf_counter() - start
+
+        result = summarize('predict', dict(params, concurrency=workers),
+                           [latency for latency, _ in outcomes], wall_seconds)
+        result['errors'] = sum(1 for _, status in outcomes if status != 200)
+        results.append(result)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(seed=0, repeat=50, image_counts=(1, 5, 10), image_resolutions=('vga', 'hd'),
+              requests=200, concurrency=(1, 4), pedoscan_shape='64x32', image_count=5,
+              image_resolution='vga', micro=True, end_to_end=True):
+    """
+    Run the selected benchmarks; returns the JSON-serialisable report
+    """
+    import_start = time.perf_counter()
+    import app as app_module
+    import_seconds = time.perf_counter() - import_start
+
+    predictor = app_module.predictor
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+            'scorer': 'model' if predictor.ulceration_model is not None else 'heuristic',
+            'app_import_seconds': import_seconds
+        },
+        'micro': [],
+        'end_to_end': []
+    }
+
+    if micro:
+        report['micro'] = run_micro(predictor, ExamGenerator(seed), repeat, image_counts, image_resolutions)
+        report['meta']['peak_rss_mb_after_micro'] = peak_rss_mb()
+    if end_to_end:
+        report['end_to_end'] = run_end_to_end(app_module.app, ExamGenerator(seed), requests, concurrency,
+                                              pedoscan_shape, image_count, image_resolution)
+    report['meta']['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+def result_key(section, result):
+    return (section, result['name'], json.dumps(result['params'], sort_keys=True))
+
+def compare_reports(baseline, current, metric='p50_ms', threshold=0.1):
+    """
+    (rows, regressions) comparing metric between two reports; a regression is a
+    benchmark whose metric grew by more than threshold (a fraction)
+    """
+    baseline_results = {
+        result_key(section, result): result
+        for section in ('micro', 'end_to_end') for result in baseline.get(section, [])
+    }
+    rows = []
+    regressions = []
+    for section in ('micro', 'end_to_end'):
+        for result in current.get(section, []):
+            before = baseline_results.get(result_key(section, result))
+            if before is None or not before[metric]:
+                continue
+            ratio = result[metric] / before[metric]
+            row = (section, result['name'], result['params'], before[metric], result[metric], ratio)
+            rows.append(row)
+            if ratio > 1 + threshold:
+                regressions.append(row)
+    return rows, regressions
@@ -0,0 +1,130 @@
+"""
+Synthetic exam payloads in the /predict format
+
+ExamGenerator is seeded, so the same seed always yields the same payloads and
+benchmark runs on different commits score identical inputs.
+"""
+import base64
+from io import BytesIO
+
+import numpy as np
+
+# (height, width) of the supported pedoscan grids
+PEDOSCAN_SHAPES = {
+    '64x32': (64, 32),
+    '128x64': (128, 64),
+    '256x128': (256, 128)
+}
+
+# (width, height) of foot photographs
+IMAGE_RESOLUTIONS = {
+    'vga': (640, 480),
+    'hd': (1280, 960),
+    'camera': (4032, 3024)
+}
+
+# Plantar pressure blobs as (row, column, radius) fractions of the grid and peak kPa
+PRESSURE_BLOBS = (
+    (0.08, 0.35, 0.07, 180.0),  # hallux
+    (0.25, 0.30, 0.10, 260.0),  # first metatarsal head
+    (0.27, 0.62, 0.10, 210.0),  # lateral metatarsal heads
+    (0.55, 0.60, 0.12, 90.0),   # lateral midfoot
+    (0.84, 0.48, 0.13, 300.0)   # heel
+)
+
+class ExamGenerator:
+    """
+    Realistic random exams: neurotouch dicts, plantar pressure matrices, JPEG
+    foot photographs and arterial readings
+    """
+    def __init__(self, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self._images = {}
+
+    def neurotouch(self):
+        rng = self.rng
+        points = ['hallux', 'met1', 'met3', 'met5', 'heel', 'arch', 'dorsum', 'toe3', 'toe5', 'lateral']
+        return {
+            'monofilament': {
+                'risk_score': float(rng.beta(2, 5)),
+                'tactile_sensation': float(rng.uniform(0.2, 1.0)),
+                'affected_points': list(rng.choice(points, rng.integers(0, 6), replace=False))
+            },
+            'vibration': {
+                'risk_score': float(rng.beta(2, 5)),
+                'threshold': float(rng.uniform(5, 45)),
+                'affected_points': list(rng.choice(points, rng.integers(0, 4), replace=False))
+            },
+            'hot_perception': {'risk_score': float(rng.beta(2, 6)), 'threshold': float(rng.uniform(38, 50))},
+            'cold_perception': {'risk_score': float(rng.beta(2, 6)), 'threshold': float(rng.uniform(5, 25))}
+        }
+
+    def pressure_matrix(self, shape=(64, 32)):
+        """
+        Plantar pressure map (kPa) with toe, forefoot and heel loading and sensor noise
+        """
+        height, width = shape
+        rows = np.linspace(0, 1, height)[:, None]
+        cols = np.linspace(0, 1, width)[None, :]
+        pressure = np.zeros(shape)
+        for row, col, radius, peak in PRESSURE_BLOBS:
+            spread = radius * self.rng.uniform(0.8, 1.2)
+            load = peak * self.rng.uniform(0.6, 1.4)
+            pressure += load * np.exp(-((rows - row) ** 2 + ((cols - col) * 0.5) ** 2) / (2 * spread ** 2))
+        pressure += self.rng.normal(0, 4, shape)
+        # Sensors outside the footprint read zero
+        pressure[pressure < 15] = 0
+        return np.round(pressure, 1)
+
+    def foot_image(self, resolution='vga'):
+        """
+        Base64 JPEG data URL of a textured foot-coloured shape on a background
+        """
+        from PIL import Image
+
+        width, height = IMAGE_RESOLUTIONS.get(resolution, resolution)
+        y, x = np.ogrid[:height, :width]
+        foot = ((x - width / 2) / (width * 0.22)) ** 2 + ((y - height / 2) / (height * 0.45)) ** 2 <= 1
+
+        image = np.empty((height, width, 3), dtype=np.float32)
+        image[:] = (40, 60, 70)
+        skin = np.array([self.rng.uniform(170, 230), self.rng.uniform(120, 170), self.rng.uniform(100, 140)])
+        image[foot] = skin
+        image += self.rng.normal(0, 12, (height, width, 1))
+        buffer = BytesIO()
+        Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=85)
+        return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+    def foot_images(self, count, resolution='vga'):
+        """
+        count distinct images; encoding is slow at camera resolution, so a small
+        pool of images per resolution is reused
+        """
+        pool = self._images.setdefault(resolution, [])
+        while len(pool) < min(count, 4):
+            pool.append(self.foot_image(resolution))
+        return [pool[i % len(pool)] for i in range(count)]
+
+    def arterial(self):
+        rng = self.rng
+        arm = rng.normal(130, 15, 2)
+        abi = rng.normal(0.95, 0.2, 2).clip(0.3, 1.5)
+        tbi = rng.normal(0.7, 0.15, 2).clip(0.2, 1.1)
+        return {
+            'abi': {'right': float(abi[0]), 'left': float(abi[1])},
+            'tbi': {'right': float(tbi[0]), 'left': float(tbi[1])},
+            'pressures': {
+                'arm_right': int(arm[0]), 'arm_left': int(arm[1]),
+                'ankle_right': int(arm[0] * abi[0]), 'ankle_left': int(arm[1] * abi[1]),
+                'toe_right': int(arm[0] * tbi[0]), 'toe_left': int(arm[1] * tbi[1])
+            }
+        }
+
+    def exam(self, patient_id='bench', pedoscan_shape=(64, 32), image_count=5, image_resolution='vga'):
+        return {
+            'patient_id': patient_id,
+            'neurotouch': self.neurotouch(),
+            'pedoscan': {'pressure_matrix': self.pressure_matrix(pedoscan_shape).tolist()},
+            'foot_images': self.foot_images(image_count, image_resolution),
+            'arterial': self.arterial()
+        }
@@ -0,0 +1,374 @@
+"""
+Cohort rescoring of exam archives
+
+Streams exams from a JSONL file (one exam per line in the /predict format,
+optionally gzipped) or a Parquet file (one exam per row, as nested columns or
+as a JSON 'exam' column) in fixed-size chunks. Each chunk is scored with
+DiabeticFootPredictor.predict_batch in a pool of worker processes, one per
+core, and written as one Parquet part in the output directory. At most
+max_in_flight chunks are read ahead of the workers, so memory is bounded by the
+chunk size and not by the size of the archive.
+
+Parts are written under a temporary name and renamed once complete. An
+interrupted run is resumed by running the same command again: chunks whose part
+already exists are skipped.
+
+Usage:
+    python cohort.py exams.jsonl results/ [--chunk-size 500] [--workers 8]
+
+The output directory can be read as one table, e.g. pandas.read_parquet('results/').
+"""
+import argparse
+import glob
+import gzip
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Archive exams are scored on their own: they are not recorded in (or trended
+# against) the patient history, and each payload is seen once, so the feature
+# cache is skipped. One process per core, so native libraries run single-threaded.
+os.environ.setdefault('HISTORY_ENABLED', 'false')
+os.environ.setdefault('FEATURE_CACHE_BACKEND', 'none')
+os.environ.setdefault('METRICS_DIR', '')
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+
+from progression import COMPONENTS as PROGRESSION_COMPONENTS, DEFAULT_HORIZONS, horizon_label
+
+DEFAULT_CHUNK_SIZE = 500
+MANIFEST_FILE = '_manifest.json'
+REPORT_FILE = '_report.json'
+
+# Result columns read from feature_analysis
+FEATURE_COLUMNS = (
+    ('neurotouch_score', ('neurotouch_score',)),
+    ('max_pressure', ('pressure_analysis', 'max_pressure')),
+    ('high_pressure_percentage', ('pressure_analysis', 'high_pressure_percentage')),
+    ('abi_average', ('vascular_analysis', 'abi_average')),
+    ('tbi_average', ('vascular_analysis', 'tbi_average')),
+    ('vascular_risk_score', ('vascular_analysis', 'vascular_risk_score'))
+)
+PROGRESSION_COLUMNS = tuple(
+    (f'{component}_{horizon_label(years)}', horizon_label(years), component)
+    for years in DEFAULT_HORIZONS for component in PROGRESSION_COMPONENTS
+)
+
+def result_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [('row', pa.int64()), ('patient_id', pa.string()), ('exam_date', pa.string()), ('error', pa.string()),
+         ('ulceration_risk', pa.float64()), ('risk_level', pa.string()), ('confidence', pa.float64())]
+        + [(name, pa.float64()) for name, _ in FEATURE_COLUMNS]
+        + [(name, pa.float64()) for name, _, _ in PROGRESSION_COLUMNS]
+        # JSON list of the recommendation dicts
+        + [('recommendations', pa.string())]
+    )
+
+def part_path(output_dir, chunk_index):
+    return os.path.join(output_dir, f'part-{chunk_index:06d}.parquet')
+
+def is_parquet(path):
+    return path.endswith(('.parquet', '.pq'))
+
+def iter_chunks(path, chunk_size):
+    """
+    (start_row, records) for each chunk of an archive; records are raw JSONL
+    lines or a Parquet RecordBatch, decoded in the workers
+    """
+    start = 0
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield start, batch
+            start += batch.num_rows
+        return
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                return
+            yield start, lines
+            start += len(lines)
+
+def count_rows(path):
+    """
+    Number of exams in a Parquet archive (from its footer), None for JSONL
+    """
+    if not is_parquet(path):
+        return None
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(path).metadata.num_rows
+
+def drop_nulls(value):
+    """
+    Copy of a decoded Parquet row without null struct fields, at any depth
+    Parquet gives every row every field of the archive's schema, so a row
+    without e.g. vibration data has neurotouch.vibration = None where the
+    extractors expect the key to be absent
+    """
+    if isinstance(value, dict):
+        return {key: drop_nulls(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [drop_nulls(item) for item in value]
+    return value
+
+def decode_records(start_row, records):
+    """
+    (row number, exam dict or None, decode error) for each record of a chunk
+    Blank JSONL lines are skipped; null Parquet fields are dropped so that the
+    modality defaults apply.
+    """
+    if isinstance(records, list):
+        for offset, line in enumerate(records):
+            if not line.strip():
+                continue
+            try:
+                yield start_row + offset, json.loads(line), None
+            except ValueError as e:
+                yield start_row + offset, None, f'invalid JSON: {e}'
+        return
+
+    for offset, row in enumerate(records.to_pylist()):
+        try:
+            exam = json.loads(row['exam']) if isinstance(row.get('exam'), str) else row
+            yield start_row + offset, drop_nulls(exam), None
+        except ValueError as e:
+            yield start_row + offset, None, f'invalid JSON: {e}'
+
+def result_row(row, exam, response):
+    """
+    Flat result record of one exam from its prediction response (or error)
+    """
+    exam_date = exam.get('exam_date') if exam else None
+    record = {
+        'row': row,
+        'patient_id': str(response['patient_id']) if response.get('patient_id') is not None else None,
+        'exam_date': str(exam_date) if exam_date is not None else None,
+        'error': response.get('error')
+    }
+    if 'error' in response:
+        return record
+
+    risk = response['risk_assessment']
+    record.update(ulceration_risk=risk['current_ulceration_risk'], risk_level=risk['risk_level'],
+                  confidence=risk['confidence'])
+    for name, path in FEATURE_COLUMNS:
+        value = response['feature_analysis']
+        for key in path:
+            value = value[key]
+        record[name] = value
+    for name, label, component in PROGRESSION_COLUMNS:
+        record[name] = response['progression_predictions'][label][component]
+    record['recommendations'] = json.dumps(response['recommendations'])
+    return record
+
+_predictor = None
+
+def init_worker():
+    global _predictor
+    import app
+
+    _predictor = app.predictor
+
+def score_chunk(output_dir, chunk_index, start_row, records):
+    """
+    Score one chunk in a worker process and write its Parquet part
+    Returns the chunk's row and error counts and scoring time
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    start = time.perf_counter()
+    decoded = list(decode_records(start_row, records))
+    exams = [exam for _, exam, error in decoded if error is None]
+    responses = iter(_predictor.predict_batch(exams) if exams else [])
+
+    rows = []
+    for row, exam, error in decoded:
+        response = {'patient_id': None, 'error': error} if error is not None else next(responses)
+        rows.append(result_row(row, exam, response))
+
+    path = part_path(output_dir, chunk_index)
+    tmp_path = os.path.join(output_dir, f'.{os.path.basename(path)}.tmp')
+    pq.write_table(pa.Table.from_pylist(rows, schema=result_schema()), tmp_path)
+    os.replace(tmp_path, path)
+
+    return {
+        'chunk': chunk_index,
+        'rows': len(rows),
+        'errors': sum(1 for record in rows if record['error'] is not None),
+        'seconds': time.perf_counter() - start
+    }
+
+def check_manifest(output_dir, input_path, chunk_size):
+    """
+    Record the run's input and chunk size in the output directory, or check that
+    a resumed run uses the same ones (chunk boundaries must not move)
+    """
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = {'input': os.path.abspath(input_path), 'chunk_size': chunk_size}
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != manifest:
+            raise ValueError(f'{output_dir} holds results for {previous["input"]} with chunk size '
+                             f'{previous["chunk_size"]}; resume with the same input and chunk size '
+                             'or use a new output directory')
+        return
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+class CohortProgress:
+    """
+    Running counts of a cohort run and its periodic progress line
+    """
+    def __init__(self, total_rows=None, interval=10.0, log=print):
+        self.total_rows = total_rows
+        self.interval = interval
+        self.log = log
+        self.start = time.perf_counter()
+        self.last_log = self.start
+        self.chunks = 0
+        self.rows = 0
+        self.errors = 0
+        self.score_seconds = 0.0
+        self.skipped_chunks = 0
+        self.skipped_rows = 0
+        self.failed_chunks = []
+
+    def skipped(self, rows):
+        self.skipped_chunks += 1
+        self.skipped_rows += rows
+
+    def completed(self, result):
+        self.chunks += 1
+        self.rows += result['rows']
+        self.errors += result['errors']
+        self.score_seconds += result['seconds']
+        now = time.perf_counter()
+        if now - self.last_log >= self.interval:
+            self.last_log = now
+            self.log(self.line())
+
+    def line(self):
+        elapsed = time.perf_counter() - self.start
+        done = self.rows + self.skipped_rows
+        position = f'{done}/{self.total_rows} rows ({100 * done / self.total_rows:.1f}%)' \
+            if self.total_rows else f'{done} rows'
+        return (f'{position}, {self.rows / elapsed if elapsed else 0.0:.1f} rows/s, '
+                f'{self.errors} errors, {len(self.failed_chunks)} failed chunks, {elapsed:.0f} s')
+
+    def report(self, workers):
+        elapsed = time.perf_counter() - self.start
+        return {
+            'chunks': self.chunks,
+            'rows': self.rows,
+            'errors': self.errors,
+            'skipped_chunks': self.skipped_chunks,
+            'skipped_rows': self.skipped_rows,
+            'failed_chunks': self.failed_chunks,
+            'seconds': elapsed,
+            'rows_per_second': self.rows / elapsed if elapsed else 0.0,
+            # Share of the pool's time spent scoring; low values mean reading the input is the bottleneck
+            'worker_utilization': self.score_seconds / (elapsed * workers) if elapsed else 0.0
+        }
+
+def score_cohort(input_path, output_dir, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, max_in_flight=None,
+                 progress_interval=10.0, log=print):
+    """
+    Score every exam of an archive into Parquet parts in output_dir, resuming
+    from the parts already there. Returns the run report (also written to
+    output_dir/_report.json). A chunk that fails as a whole is reported in
+    failed_chunks and retried by the next run.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    os.makedirs(output_dir, exist_ok=True)
+    check_manifest(output_dir, input_path, chunk_size)
+    # Parts left half-written by an interrupted run
+    for path in glob.glob(os.path.join(output_dir, '.part-*.tmp')):
+        os.remove(path)
+
+    progress = CohortProgress(count_rows(input_path), progress_interval, log)
+    interrupted = False
+
+    def collect(futures):
+        for future in futures:
+            try:
+                progress.completed(future.result())
+            except Exception as e:
+                progress.failed_chunks.append(futures[future])
+                log(f'Chunk {futures[future]} failed: {e}')
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    pending = {}
+    try:
+        for chunk_index, (start_row, records) in enumerate(iter_chunks(input_path, chunk_size)):
+            if os.path.exists(part_path(output_dir, chunk_index)):
+                progress.skipped(len(records) if isinstance(records, list) else records.num_rows)
+                continue
+            # Bounded read-ahead: wait for a chunk to finish before reading more
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect({future: pending.pop(future) for future in done})
+            pending[executor.submit(score_chunk, output_dir, chunk_index, start_row, records)] = chunk_index
+        collect({future: pending[future] for future in wait(pending).done})
+        executor.shutdown()
+    except KeyboardInterrupt:
+        interrupted = True
+        executor.shutdown(wait=True, cancel_futures=True)
+        # Count the parts that were written before the interrupt
+        collect({future: chunk_index for future, chunk_index in pending.items()
+                 if future.done() and not future.cancelled() and future.exception() is None})
+        log('Interrupted; run the same command again to resume')
+
+    report = {
+        'input': os.path.abspath(input_path),
+        'output': os.path.abspath(output_dir),
+        'chunk_size': chunk_size,
+        'workers': workers,
+        'interrupted': interrupted
+    }
+    report.update(progress.report(workers))
+    with open(os.path.join(output_dir, REPORT_FILE), 'w') as f:
+        json.dump(report, f, indent=2)
+    log(progress.line())
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rescore an exam archive into Parquet')
+    parser.add_argument('input', help='JSONL (.jsonl, .jsonl.gz) or Parquet file of exams')
+    parser.add_argument('output', help='directory of Parquet result parts')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='exams per part')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='chunks read ahead of the workers (default: twice the workers)')
+    parser.add_argument('--progress-interval', type=float, default=10.0, help='seconds between progress lines')
+
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr, flush=True)
+
+    try:
+        report = score_cohort(args.input, args.output, args.chunk_size, args.workers, args.max_in_flight,
+                              args.progress_interval, log)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 2
+
+    print(json.dumps(report, indent=2))
+    if report['interrupted']:
+        return 130
+    return 1 if report['failed_chunks'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
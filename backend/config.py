@@ -8,11 +8,72 @@ class Config:
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000').split(',')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+    PEDOSCAN_RECORDINGS_DIR = os.environ.get('PEDOSCAN_RECORDINGS_DIR', UPLOAD_FOLDER)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
     
     # ML Model settings
-    MODEL_PATH = os.path.join(os.path.dirname(__file__), 'models')
+    MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(os.path.dirname(__file__), 'models'))
+    MODEL_ENABLED = os.environ.get('MODEL_ENABLED', 'true').lower() == 'true'
+    MODEL_MMAP_MODE = os.environ.get('MODEL_MMAP_MODE', 'r')  # '' reads artifacts through joblib's buffers
     PREDICTION_CONFIDENCE_THRESHOLD = 0.7
     
+    # Intervention recommendation rules (JSON rule table, see recommendation_rules.py)
+    RECOMMENDATION_RULES_PATH = os.environ.get('RECOMMENDATION_RULES_PATH', os.path.join(os.path.dirname(__file__), 'recommendation_rules.json'))
+    
+    # Image analysis settings
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 4))  # concurrent images per worker process
+    IMAGE_ANALYSIS_MAX_SIDE = int(os.environ.get('IMAGE_ANALYSIS_MAX_SIDE', 1024))  # decoded px, 0 = full resolution
+    IMAGE_ROI_ENABLED = os.environ.get('IMAGE_ROI_ENABLED', 'true').lower() == 'true'  # crop to the detected foot
+    IMAGE_ANALYSIS_TARGET_SIDE = int(os.environ.get('IMAGE_ANALYSIS_TARGET_SIDE', 512))  # px of the analysed crop
+    
+    # Predict responses: bodies of at least RESPONSE_COMPRESS_MIN_BYTES are gzip or brotli
+    # compressed when the client accepts it
+    RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+    RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 6))
+    RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', 4))
+    
+    # Feature cache settings: 'memory' (per worker), 'sqlite' (shared by workers), 'redis' or 'none'
+    FEATURE_CACHE_BACKEND = os.environ.get('FEATURE_CACHE_BACKEND', 'memory')
+    FEATURE_CACHE_MAX_BYTES = int(os.environ.get('FEATURE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    FEATURE_CACHE_PATH = os.environ.get('FEATURE_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'cache', 'features.sqlite3'))
+    FEATURE_CACHE_URL = os.environ.get('FEATURE_CACHE_URL', 'redis://localhost:6379/0')
+    
+    # Concurrent extractions per modality within a worker process, e.g. 'foot_images=2,pedoscan=4'
+    # (requests beyond a limit wait up to MODALITY_WAIT_TIMEOUT seconds, then get a 503)
+    MODALITY_CONCURRENCY = os.environ.get('MODALITY_CONCURRENCY', 'foot_images=2')
+    MODALITY_WAIT_TIMEOUT = float(os.environ.get('MODALITY_WAIT_TIMEOUT', 5))
+    
+    # ASGI serving mode (asgi.py): heavy requests executing / queued per process,
+    # seconds a queued request may wait before a 503, and the Retry-After hint
+    ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', 4))
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 16))
+    ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 1))
+    ASGI_LIGHT_WORKERS = int(os.environ.get('ASGI_LIGHT_WORKERS', 2))
+    ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', 64 * 1024 * 1024))
+    
+    # Background prediction jobs: store shared by the worker processes, job threads and
+    # queued-or-running job limit per process, and seconds finished results are kept
+    JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(os.path.dirname(__file__), 'cache', 'jobs.sqlite3'))
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 32))
+    JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))
+    
+    # Patient exam history and trend features (slopes need HISTORY_MIN_TREND_EXAMS exams
+    # spanning HISTORY_MIN_TREND_DAYS)
+    HISTORY_ENABLED = os.environ.get('HISTORY_ENABLED', 'true').lower() == 'true'
+    HISTORY_PATH = os.environ.get('HISTORY_PATH', os.path.join(os.path.dirname(__file__), 'data', 'history.sqlite3'))
+    HISTORY_MIN_TREND_EXAMS = int(os.environ.get('HISTORY_MIN_TREND_EXAMS', 3))
+    HISTORY_MIN_TREND_DAYS = float(os.environ.get('HISTORY_MIN_TREND_DAYS', 30))
+    
+    # Metrics: per-process snapshots merged by /metrics (directory shared by the workers,
+    # emptied on redeploy) and the optional per-request sampling profiler (?profile=1)
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'metrics'))
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0))
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'profiles'))
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+    
     # Database settings (if you plan to add database later)
     DATABASE_URL = os.environ.get('DATABASE_URL')
     
@@ -0,0 +1,121 @@
+"""
+Response encodings for the predict endpoints
+
+The body format follows the Accept header: msgpack for application/msgpack
+(or application/x-msgpack), JSON otherwise. JSON is written with orjson when it
+is installed, which serializes NumPy scalars and arrays natively, and with the
+standard library otherwise. Bodies of at least min_compress_bytes are
+compressed as the client's Accept-Encoding allows, brotli (when the brotli
+package is installed) being preferred over gzip.
+
+Field selection (?fields=risk_assessment,progression_predictions.year_1) is
+applied before serializing, so a client that only needs the risk score does not
+pay for encoding and transferring the rest of the response.
+"""
+import gzip
+import json
+
+import numpy as np
+
+from pressure_io import MSGPACK_CONTENT_TYPES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_CONTENT_TYPE = 'application/json'
+
+# Kept by every field selection so results can still be matched to patients
+ALWAYS_SELECTED = ('patient_id', 'error')
+
+def parse_fields(value):
+    """
+    Field paths of a ?fields= value as tuples of keys, or None for all fields
+    """
+    if not value:
+        return None
+    paths = [tuple(key for key in field.strip().split('.') if key) for field in value.split(',')]
+    return [path for path in paths if path] or None
+
+def select_fields(response, paths):
+    """
+    Copy of one prediction response with only the given field paths (plus
+    patient_id and error); paths that do not exist are ignored
+    """
+    if paths is None or not isinstance(response, dict):
+        return response
+    selected = {key: response[key] for key in ALWAYS_SELECTED if key in response}
+    for path in paths:
+        source, target = response, selected
+        for key in path[:-1]:
+            source = source.get(key) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(key, {})
+        else:
+            if isinstance(source, dict) and path[-1] in source:
+                target[path[-1]] = source[path[-1]]
+    return selected
+
+def _default(value):
+    # NumPy values the standard library and msgpack do not serialize natively
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not serializable')
+
+def dumps_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode()
+
+def dumps_msgpack(payload):
+    import msgpack
+    return msgpack.packb(payload, default=_default, use_bin_type=True)
+
+class ResponseEncoder:
+    """
+    Serializes and compresses response payloads as negotiated with the client
+    """
+    def __init__(self, min_compress_bytes=1024, gzip_level=6, brotli_quality=4):
+        self.min_compress_bytes = min_compress_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def content_encoding(self, accept_encodings):
+        """
+        Compression to use for werkzeug's parsed Accept-Encoding, or None
+        """
+        return accept_encodings.best_match(self.encodings)
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    def encode(self, payload, accept_mimetypes, accept_encodings):
+        """
+        (body, headers) for a payload given werkzeug's parsed Accept and
+        Accept-Encoding headers
+        """
+        content_type = accept_mimetypes.best_match((JSON_CONTENT_TYPE,) + MSGPACK_CONTENT_TYPES,
+                                                   default=JSON_CONTENT_TYPE)
+        if content_type in MSGPACK_CONTENT_TYPES:
+            body = dumps_msgpack(payload)
+        else:
+            body = dumps_json(payload)
+
+        headers = {'Content-Type': content_type, 'Vary': 'Accept, Accept-Encoding'}
+        encoding = self.content_encoding(accept_encodings) if len(body) >= self.min_compress_bytes else None
+        if encoding is not None:
+            body = self.compress(body, encoding)
+            headers['Content-Encoding'] = encoding
+        return body, headers
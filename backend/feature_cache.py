@@ -0,0 +1,279 @@
+"""
+Content-addressed cache for per-modality feature extraction
+
+Features are keyed by a hash of the modality's payload, so re-running /predict for
+a patient with only one changed modality reuses the features of the others.
+Cached values are the modality's block of the FeatureVector (values, presence).
+Settings an extractor depends on (e.g. the image analysis resolution) are part
+of the key, so changing them does not serve features computed under the old ones.
+Backends:
+- memory: per-process LRU bounded by the pickled size of the cached features
+- sqlite: file shared by all worker processes on a host (stand-in for Redis)
+- redis:  shared Redis server (requires the redis package)
+"""
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import METRICS
+
+# Bump when extractor output changes so previously cached features are not reused
+FEATURE_VERSION = 5
+
+def _update_digest(digest, obj):
+    if isinstance(obj, np.ndarray):
+        digest.update(b'a' + str((obj.dtype.str, obj.shape)).encode())
+        digest.update(np.ascontiguousarray(obj).data)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        digest.update(b'b%d:' % len(obj))
+        digest.update(obj)
+    elif isinstance(obj, str):
+        digest.update(b's%d:' % len(obj))
+        digest.update(obj.encode())
+    elif isinstance(obj, dict):
+        digest.update(b'{')
+        for key in sorted(obj):
+            _update_digest(digest, key)
+            _update_digest(digest, obj[key])
+        digest.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        encoded = None
+        if obj and isinstance(obj[0], (list, int, float)):
+            # Numeric (nested) lists: hash their compact JSON text in one C-level call
+            try:
+                encoded = json.dumps(obj, separators=(',', ':')).encode()
+            except TypeError:
+                pass
+        if encoded is not None:
+            digest.update(b'j' + encoded)
+        else:
+            digest.update(b'[')
+            for item in obj:
+                _update_digest(digest, item)
+            digest.update(b']')
+    elif hasattr(obj, 'read') and hasattr(obj, 'seek'):
+        # Uploaded file: hash its content and rewind it for the extractor
+        digest.update(b'f')
+        digest.update(obj.read())
+        obj.seek(0)
+    else:
+        digest.update(b'r' + repr(obj).encode())
+
+def payload_digest(modality, payload, settings=()):
+    """
+    Content hash of one modality payload, extracted under the given settings
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f'{modality}:{FEATURE_VERSION}:'.encode())
+    _update_digest(digest, settings)
+    _update_digest(digest, payload)
+    return digest.hexdigest()
+
+class MemoryCacheBackend:
+    """
+    In-process LRU cache evicting least recently used entries beyond max_bytes
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def info(self):
+        return {'backend': 'memory', 'entries': len(self._entries),
+                'bytes': self.current_bytes, 'max_bytes': self.max_bytes}
+
+class SQLiteCacheBackend:
+    """
+    Cache file shared by every worker process on the host
+    Entries beyond max_bytes are evicted least recently used first
+    """
+    # Check the total size every this many writes
+    EVICTION_INTERVAL = 64
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS features ('
+                         'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                         'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS features_accessed ON features (accessed)')
+
+    def _connect(self):
+        # One connection per thread and process; connections must not cross a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value FROM features WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE features SET accessed = ? WHERE key = ?', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO features (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                     (key, blob, len(blob), time.time()))
+        self._writes += 1
+        if self._writes % self.EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        conn = self._connect()
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM features').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            freed = 0
+            for key, size in conn.execute('SELECT key, size FROM features ORDER BY accessed').fetchall():
+                if freed >= excess:
+                    break
+                conn.execute('DELETE FROM features WHERE key = ?', (key,))
+                freed += size
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def info(self):
+        entries, total = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM features').fetchone()
+        return {'backend': 'sqlite', 'path': self.path, 'entries': entries,
+                'bytes': total, 'max_bytes': self.max_bytes}
+
+class RedisCacheBackend:
+    """
+    Shared Redis cache; eviction is left to the server's maxmemory policy
+    """
+    def __init__(self, url, ttl_seconds=24 * 3600, prefix='dfcare:features:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, key):
+        blob = self.client.get(self.prefix + key)
+        return None if blob is None else pickle.loads(blob)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                        ex=self.ttl_seconds)
+
+    def info(self):
+        return {'backend': 'redis', 'ttl_seconds': self.ttl_seconds}
+
+class FeatureCache:
+    """
+    Wraps feature extractors with a content-addressed cache and counts hits and misses
+    modality_settings: {modality: tuple of extractor settings folded into its keys}
+    """
+    def __init__(self, backend, modality_settings=None):
+        self.backend = backend
+        self.modality_settings = modality_settings or {}
+        self.hits = {}
+        self.misses = {}
+
+    def lookup(self, modality, payload):
+        """
+        (key, cached value) for a payload; the value is None on a miss and the key
+        is None when caching is disabled. Cached values must not be mutated.
+        """
+        if self.backend is None:
+            return None, None
+
+        key = payload_digest(modality, payload, self.modality_settings.get(modality, ()))
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits[modality] = self.hits.get(modality, 0) + 1
+        else:
+            self.misses[modality] = self.misses.get(modality, 0) + 1
+        METRICS.inc('dfcare_feature_cache_total', modality=modality, result='miss' if value is None else 'hit')
+        return key, value
+
+    def store(self, key, value):
+        """
+        Cache a value under a key returned by lookup
+        """
+        if key is not None and self.backend is not None:
+            self.backend.set(key, value)
+
+    def stats(self):
+        modalities = sorted(set(self.hits) | set(self.misses))
+        stats = {
+            'enabled': self.backend is not None,
+            'pid': os.getpid(),
+            'hits': sum(self.hits.values()),
+            'misses': sum(self.misses.values()),
+            'modalities': {
+                modality: {'hits': self.hits.get(modality, 0), 'misses': self.misses.get(modality, 0)}
+                for modality in modalities
+            }
+        }
+        if self.backend is not None:
+            stats.update(self.backend.info())
+        return stats
+
+def build_feature_cache(settings):
+    """
+    FeatureCache for the FEATURE_CACHE_* settings
+    """
+    backend_name = settings.FEATURE_CACHE_BACKEND
+    if backend_name == 'memory':
+        backend = MemoryCacheBackend(settings.FEATURE_CACHE_MAX_BYTES)
+    elif backend_name == 'sqlite':
+        backend = SQLiteCacheBackend(settings.FEATURE_CACHE_PATH, settings.FEATURE_CACHE_MAX_BYTES)
+    elif backend_name == 'redis':
+        backend = RedisCacheBackend(settings.FEATURE_CACHE_URL)
+    elif backend_name in ('none', '', None):
+        backend = None
+    else:
+        raise ValueError(f'Unknown FEATURE_CACHE_BACKEND: {backend_name}')
+
+    return FeatureCache(backend, {
+        'foot_images': (settings.IMAGE_ANALYSIS_MAX_SIDE, settings.IMAGE_ROI_ENABLED,
+                        settings.IMAGE_ANALYSIS_TARGET_SIDE)
+    })
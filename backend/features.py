@@ -0,0 +1,279 @@
+"""
+Declared feature schema and array-backed feature records
+
+FEATURE_SCHEMA is the ordered registry of every feature the extractors can
+produce, with its modality, default and dtype. A FeatureVector stores one exam's
+features in a float64 array laid out in schema order; extractors write into it by
+name, scorers and models read it by index, and a FeatureMatrix holds the vectors
+of a whole batch as rows of one 2-D array.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+FeatureSpec = namedtuple('FeatureSpec', ['name', 'modality', 'default', 'dtype'])
+
+# Per-image features are declared for this many images; further images are not analysed
+MAX_FOOT_IMAGES = 10
+
+NEUROTOUCH_FEATURES = (
+    ('mono_risk_score', 0.0, float), ('mono_tactile_sensation', 0.0, float), ('mono_affected_points', 0, int),
+    ('vibration_risk_score', 0.0, float), ('vibration_threshold', 0.0, float), ('vibration_affected_points', 0, int),
+    ('hot_risk_score', 0.0, float), ('hot_threshold', 0.0, float),
+    ('cold_risk_score', 0.0, float), ('cold_threshold', 0.0, float),
+    ('overall_neuropathy_score', 0.0, float)
+)
+
+PEDOSCAN_STATIC_FEATURES = (
+    ('max_pressure', 0.0, float), ('mean_pressure', 0.0, float),
+    ('pressure_variance', 0.0, float), ('pressure_std', 0.0, float),
+    ('high_pressure_area', 0.0, float), ('high_pressure_percentage', 0.0, float),
+    ('forefoot_max_pressure', 0.0, float), ('forefoot_mean_pressure', 0.0, float),
+    ('midfoot_max_pressure', 0.0, float), ('midfoot_mean_pressure', 0.0, float),
+    ('rearfoot_max_pressure', 0.0, float), ('rearfoot_mean_pressure', 0.0, float),
+    ('pressure_gradient_magnitude', 0.0, float), ('cop_x', 0.0, float), ('cop_y', 0.0, float)
+)
+
+# Static features are those of the worst foot for bilateral exams, which also
+# get each foot's static features and the left / right asymmetry
+PEDOSCAN_FEATURES = PEDOSCAN_STATIC_FEATURES + tuple(
+    (f'{side}_{name}', default, dtype) for side in ('left', 'right') for name, default, dtype in PEDOSCAN_STATIC_FEATURES
+) + (
+    ('peak_pressure_ratio', 1.0, float), ('peak_pressure_asymmetry', 0.0, float),
+    ('cop_offset_x', 0.0, float), ('cop_offset_y', 0.0, float),
+    # Gait recordings only
+    ('frame_count', 0.0, float), ('duration_s', 0.0, float), ('contact_time_s', 0.0, float),
+    ('pti_max', 0.0, float), ('pti_mean', 0.0, float),
+    ('cop_path_length', 0.0, float), ('cop_excursion_x', 0.0, float), ('cop_excursion_y', 0.0, float),
+    ('forefoot_peak_load', 0.0, float), ('forefoot_load_impulse', 0.0, float),
+    ('midfoot_peak_load', 0.0, float), ('midfoot_load_impulse', 0.0, float),
+    ('rearfoot_peak_load', 0.0, float), ('rearfoot_load_impulse', 0.0, float)
+)
+
+# Per image: statistics of the cropped foot, the foot detection, and colour and
+# texture statistics of the forefoot, midfoot and rearfoot (heel) regions
+IMAGE_FEATURES = (
+    ('mean_intensity', 0.0, float), ('std_intensity', 0.0, float), ('contrast', 0.0, float),
+    ('texture_variance', 0.0, float), ('edge_density', 0.0, float),
+    ('red_mean', 0.0, float), ('green_mean', 0.0, float), ('blue_mean', 0.0, float), ('red_ratio', 0.0, float),
+    ('roi_detected', 0, int), ('foot_area_fraction', 0.0, float)
+) + tuple(
+    (f'{region}_{name}', 0.0, float)
+    for region in ('forefoot', 'midfoot', 'rearfoot')
+    for name in ('mean_intensity', 'texture_variance', 'edge_density', 'red_mean', 'green_mean', 'blue_mean',
+                 'red_ratio')
+)
+
+ARTERIAL_FEATURES = (
+    ('abi_right', 1.0, float), ('abi_left', 1.0, float), ('abi_average', 1.0, float), ('abi_asymmetry', 0.0, float),
+    ('tbi_right', 1.0, float), ('tbi_left', 1.0, float), ('tbi_average', 1.0, float), ('tbi_asymmetry', 0.0, float),
+    ('arm_pressure_right', 120.0, float), ('arm_pressure_left', 120.0, float),
+    ('ankle_pressure_right', 120.0, float), ('ankle_pressure_left', 120.0, float),
+    ('toe_pressure_right', 100.0, float), ('toe_pressure_left', 100.0, float),
+    ('pressure_gradient_right', 20.0, float), ('pressure_gradient_left', 20.0, float),
+    ('vascular_risk_score', 0, int)
+)
+
+# Patient trends from the exam history (history.py); slopes are per year and only
+# present once enough exams have been recorded
+HISTORY_FEATURES = (
+    ('history_exam_count', 0, int), ('history_span_years', 0.0, float),
+    ('pressure_slope', 0.0, float), ('neuropathy_trend', 0.0, float), ('abi_drift', 0.0, float)
+)
+
+def image_feature_name(index, name):
+    return f'img_{index}_{name}'
+
+def _image_specs():
+    specs = [FeatureSpec('image_count', 'foot_images', 0, int)]
+    for i in range(MAX_FOOT_IMAGES):
+        specs.extend(FeatureSpec(image_feature_name(i, name), 'foot_images', default, dtype)
+                     for name, default, dtype in IMAGE_FEATURES)
+    return specs
+
+class FeatureSchema:
+    """
+    Ordered registry of feature specs; features of a modality are contiguous
+    """
+    def __init__(self, specs):
+        self.specs = tuple(specs)
+        self.names = tuple(spec.name for spec in self.specs)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        if len(self.index) != len(self.names):
+            raise ValueError('Duplicate feature names in schema')
+        self.defaults = np.array([spec.default for spec in self.specs], dtype=np.float64)
+        self.defaults.flags.writeable = False
+        self.casts = tuple(spec.dtype for spec in self.specs)
+
+        self.modality_slices = {}
+        start = 0
+        for stop in range(1, len(self.specs) + 1):
+            if stop == len(self.specs) or self.specs[stop].modality != self.specs[start].modality:
+                modality = self.specs[start].modality
+                if modality in self.modality_slices:
+                    raise ValueError(f'Features of modality {modality!r} are not contiguous')
+                self.modality_slices[modality] = slice(start, stop)
+                start = stop
+
+    def __len__(self):
+        return len(self.specs)
+
+    def indices(self, names):
+        """
+        Column indices of the given feature names
+        """
+        return np.array([self.index[name] for name in names], dtype=np.intp)
+
+    def new_matrix(self, rows):
+        return FeatureMatrix(rows, self)
+
+FEATURE_SCHEMA = FeatureSchema(
+    [FeatureSpec(name, 'neurotouch', default, dtype) for name, default, dtype in NEUROTOUCH_FEATURES]
+    + [FeatureSpec(name, 'pedoscan', default, dtype) for name, default, dtype in PEDOSCAN_FEATURES]
+    + _image_specs()
+    + [FeatureSpec(name, 'arterial', default, dtype) for name, default, dtype in ARTERIAL_FEATURES]
+    + [FeatureSpec(name, 'history', default, dtype) for name, default, dtype in HISTORY_FEATURES]
+)
+
+class FeatureVector:
+    """
+    One exam's features in schema order
+
+    Supports the dict operations the extractors and scorers use (item access,
+    get, in, items) while storing values in a float64 array; features that were
+    never written hold their schema default and are not 'present'.
+    """
+    __slots__ = ('schema', 'values', 'present')
+
+    def __init__(self, schema=FEATURE_SCHEMA, values=None, present=None):
+        self.schema = schema
+        self.values = schema.defaults.copy() if values is None else values
+        self.present = np.zeros(len(schema), dtype=bool) if present is None else present
+
+    @classmethod
+    def from_dict(cls, mapping, schema=FEATURE_SCHEMA):
+        """
+        FeatureVector from a mapping; names outside the schema are ignored
+        """
+        vector = cls(schema)
+        for name, value in mapping.items():
+            if name in schema.index:
+                vector[name] = value
+        return vector
+
+    def __getitem__(self, name):
+        i = self.schema.index[name]
+        if not self.present[i]:
+            raise KeyError(name)
+        return self.schema.casts[i](self.values[i])
+
+    def __setitem__(self, name, value):
+        i = self.schema.index[name]
+        self.values[i] = value
+        self.present[i] = True
+
+    def __contains__(self, name):
+        i = self.schema.index.get(name)
+        return i is not None and bool(self.present[i])
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.present))
+
+    def get(self, name, default=None):
+        i = self.schema.index.get(name)
+        if i is None or not self.present[i]:
+            return default
+        return self.schema.casts[i](self.values[i])
+
+    def keys(self):
+        names = self.schema.names
+        return [names[i] for i in np.flatnonzero(self.present)]
+
+    def items(self):
+        names, casts, values = self.schema.names, self.schema.casts, self.values
+        return [(names[i], casts[i](values[i])) for i in np.flatnonzero(self.present)]
+
+    def update(self, mapping):
+        for name, value in mapping.items():
+            self[name] = value
+
+    def to_dict(self):
+        """
+        Plain dict of the present features, e.g. for JSON responses
+        """
+        return dict(self.items())
+
+    def block(self, modality):
+        """
+        Copy of one modality's values and presence flags, e.g. for caching
+        """
+        section = self.schema.modality_slices[modality]
+        return self.values[section].copy(), self.present[section].copy()
+
+    def load_block(self, modality, block):
+        section = self.schema.modality_slices[modality]
+        self.values[section], self.present[section] = block
+
+    def clear(self, modality):
+        """
+        Reset one modality's features to their defaults
+        """
+        section = self.schema.modality_slices[modality]
+        self.values[section] = self.schema.defaults[section]
+        self.present[section] = False
+
+class FeatureMatrix:
+    """
+    Features of many exams as rows of one (n_exams, n_features) array
+    """
+    __slots__ = ('schema', 'values', 'present')
+
+    def __init__(self, rows, schema=FEATURE_SCHEMA):
+        self.schema = schema
+        self.values = np.tile(schema.defaults, (rows, 1))
+        self.present = np.zeros((rows, len(schema)), dtype=bool)
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def row(self, i):
+        """
+        FeatureVector view of row i; writes go straight into the matrix
+        """
+        return FeatureVector(self.schema, self.values[i], self.present[i])
+
+    def column(self, name):
+        return self.values[:, self.schema.index[name]]
+
+    def columns(self, names):
+        return {name: self.column(name) for name in names}
+
+    def set_columns(self, rows, columns):
+        """
+        Write {name: values} into the given rows and mark those features present
+        """
+        for name, values in columns.items():
+            i = self.schema.index[name]
+            self.values[rows, i] = values
+            self.present[rows, i] = True
+
+    def take(self, rows):
+        """
+        New FeatureMatrix with the selected rows
+        """
+        subset = FeatureMatrix.__new__(FeatureMatrix)
+        subset.schema = self.schema
+        subset.values = self.values[rows]
+        subset.present = self.present[rows]
+        return subset
+
+def as_feature_vector(features):
+    """
+    FeatureVector for a FeatureVector or a plain mapping of feature values
+    """
+    if isinstance(features, FeatureVector):
+        return features
+    return FeatureVector.from_dict(features)
@@ -0,0 +1,49 @@
+"""
+Gunicorn settings
+
+    gunicorn --config backend/gunicorn.conf.py
+
+The app is imported once in the master (preload_app) and the predictor is
+warmed up before the workers are forked. The trained model, the rule table and
+the libraries loaded on import are then shared copy-on-write by every worker
+instead of being loaded once per worker; gc.freeze() keeps the collector from
+touching (and so copying) those pages afterwards.
+
+Libraries used only by some extractors (OpenCV and Pillow for foot images) are
+imported on first use in each worker. Listing them in PRELOAD_MODULES (e.g.
+'cv2,PIL.Image') loads them in the master instead: shared pages and no delay on
+the first image request, at the cost of loading them even when unused.
+
+Use 'python startup.py workers' to see the memory of the running workers.
+"""
+import gc
+import importlib
+import os
+import sys
+import time
+
+_started = time.perf_counter()
+
+# The app's modules are flat files in backend/
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+wsgi_app = 'app:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+def when_ready(server):
+    # Runs in the master once the app is loaded, before the workers are forked
+    for name in filter(None, (name.strip() for name in os.environ.get('PRELOAD_MODULES', '').split(','))):
+        importlib.import_module(name)
+
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.predictor.warm_up()
+    gc.freeze()
+
+    from startup import process_memory
+
+    server.log.info(f'Master ready in {time.perf_counter() - _started:.2f} s '
+                    f'(preload_app={preload_app}), RSS {process_memory()["rss_mb"]:.1f} MB')
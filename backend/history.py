@@ -0,0 +1,254 @@
+"""
+Longitudinal patient exam history with incremental trend features
+
+Every scored exam is stored in an exams table keyed by (patient_id,
+exam_time). Alongside it, patient_trends keeps running least-squares sums
+(n, sum t, sum t^2, sum y, sum t*y) per tracked series, so the slope of a
+patient's pressure, neuropathy score and ABI over time is updated and read in
+O(1) per exam, without rescanning the history. Time is measured in years from
+the patient's first recorded exam.
+
+Recording is idempotent: scoring an exam again (a rescore, a retried job)
+replaces the stored exam and swaps its contribution to the trend sums for the
+new one instead of counting the exam twice. Only exams with an exam_date are
+recorded; an exam without one is scored against the patient's recorded
+trends but is not added to them.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+SECONDS_PER_YEAR = 365.25 * 24 * 3600
+
+# Tracked series: (name, source feature, trend feature holding its slope per year)
+TREND_SERIES = (
+    ('pressure', 'max_pressure', 'pressure_slope'),
+    ('neuropathy', 'overall_neuropathy_score', 'neuropathy_trend'),
+    ('abi', 'abi_average', 'abi_drift')
+)
+SUM_FIELDS = ('n', 'st', 'stt', 'sy', 'sty')
+SUM_COLUMNS = tuple(f'{name}_{field}' for name, _, _ in TREND_SERIES for field in SUM_FIELDS)
+# Each exam's own series values, so a replaced exam can be taken out of the sums
+VALUE_COLUMNS = tuple(f'{name}_value' for name, _, _ in TREND_SERIES)
+
+def parse_exam_time(value):
+    """
+    Epoch seconds for an exam_date given as an ISO 8601 string or epoch number;
+    None when it is missing. Dates without a timezone are taken as UTC.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'exam_date must be an ISO 8601 date or epoch seconds, got {value!r}') from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def ols_slope(n, st, stt, sy, sty):
+    """
+    Least-squares slope of y over t from running sums; 0 when undetermined
+    """
+    denominator = n * stt - st * st
+    if n < 2 or denominator <= 1e-12:
+        return 0.0
+    return (n * sty - st * sy) / denominator
+
+def series_values(features):
+    """
+    {series name: value} of the tracked series present in a FeatureVector
+    """
+    return {name: features.get(source) for name, source, _ in TREND_SERIES}
+
+def sum_terms(t, values):
+    """
+    Contribution of one exam at time t (years from the patient's origin) to
+    the trend sums, in SUM_COLUMNS order
+    """
+    terms = []
+    for name, _, _ in TREND_SERIES:
+        y = values.get(name)
+        terms.extend((1.0, t, t * t, y, t * y) if y is not None else (0.0,) * len(SUM_FIELDS))
+    return terms
+
+class HistoryStore:
+    """
+    Exam table and per-patient trend sums in a SQLite file shared by the
+    worker processes
+    """
+    def __init__(self, path, min_trend_exams=3, min_trend_days=30):
+        self.path = path
+        self.min_trend_exams = min_trend_exams
+        self.min_trend_years = min_trend_days * 24 * 3600 / SECONDS_PER_YEAR
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS exams ('
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id TEXT NOT NULL, '
+                     'exam_time REAL NOT NULL, recorded_at REAL NOT NULL, '
+                     'ulceration_risk REAL NOT NULL, summary TEXT NOT NULL, '
+                     + ', '.join(f'{column} REAL' for column in VALUE_COLUMNS) + ', '
+                     'UNIQUE (patient_id, exam_time))')
+        conn.execute('CREATE INDEX IF NOT EXISTS exams_patient_time ON exams (patient_id, exam_time, id)')
+        conn.execute('CREATE TABLE IF NOT EXISTS patient_trends ('
+                     'patient_id TEXT PRIMARY KEY, origin REAL NOT NULL, first_time REAL NOT NULL, '
+                     'last_time REAL NOT NULL, exam_count INTEGER NOT NULL, '
+                     + ', '.join(f'{column} REAL NOT NULL DEFAULT 0' for column in SUM_COLUMNS) + ')')
+
+    def _connect(self):
+        # One connection per thread and process; connections must not cross a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _recorded_values(self, conn, patient_id, exam_time):
+        """
+        Series values of an exam already recorded at exam_time, or None
+        """
+        row = conn.execute('SELECT ' + ', '.join(VALUE_COLUMNS) + ' FROM exams '
+                           'WHERE patient_id = ? AND exam_time = ?', (patient_id, exam_time)).fetchone()
+        if row is None:
+            return None
+        return dict(zip((name for name, _, _ in TREND_SERIES), row))
+
+    def _trend_row(self, conn, patient_id):
+        return conn.execute(
+            'SELECT origin, first_time, last_time, exam_count, ' + ', '.join(SUM_COLUMNS) +
+            ' FROM patient_trends WHERE patient_id = ?', (patient_id,)).fetchone()
+
+    def trend_features(self, patient_id, exam_time=None, values=None):
+        """
+        Trend features of a patient's recorded exams, plus the exam being scored
+        when exam_time and its series values are given (in place of the
+        recorded exam at that time, if any). Slopes (per year) are only
+        included once a series has min_trend_exams exams spanning
+        min_trend_days.
+        """
+        conn = self._connect()
+        row = self._trend_row(conn, patient_id)
+        if row is None:
+            if exam_time is None:
+                return {'history_exam_count': 0, 'history_span_years': 0.0}
+            row = (exam_time, exam_time, exam_time, 0) + (0.0,) * len(SUM_COLUMNS)
+        origin, first_time, last_time, exam_count = row[:4]
+        sums = list(row[4:])
+
+        if exam_time is not None:
+            t = (exam_time - origin) / SECONDS_PER_YEAR
+            recorded = self._recorded_values(conn, patient_id, exam_time) if exam_count else None
+            if recorded is not None:
+                sums = [total - term for total, term in zip(sums, sum_terms(t, recorded))]
+            else:
+                first_time, last_time, exam_count = min(first_time, exam_time), max(last_time, exam_time), exam_count + 1
+            sums = [total + term for total, term in zip(sums, sum_terms(t, values or {}))]
+
+        span_years = (last_time - first_time) / SECONDS_PER_YEAR
+        features = {'history_exam_count': exam_count, 'history_span_years': span_years}
+        if span_years >= self.min_trend_years:
+            for i, (_, _, trend_feature) in enumerate(TREND_SERIES):
+                series_sums = sums[i * len(SUM_FIELDS):(i + 1) * len(SUM_FIELDS)]
+                if series_sums[0] >= self.min_trend_exams:
+                    features[trend_feature] = ols_slope(*series_sums)
+        return features
+
+    def record_many(self, entries):
+        """
+        Record exams and fold them into their patients' trend sums in one
+        transaction; an exam already recorded at the same exam_time is replaced
+        entries: (patient_id, exam_time, series values, ulceration_risk, summary dict)
+        """
+        if not entries:
+            return
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for patient_id, exam_time, values, ulceration_risk, summary in entries:
+                recorded = self._recorded_values(conn, patient_id, exam_time)
+                conn.execute('INSERT INTO exams (patient_id, exam_time, recorded_at, ulceration_risk, summary, '
+                             + ', '.join(VALUE_COLUMNS) + ') VALUES (?, ?, ?, ?, ?, '
+                             + ', '.join('?' * len(VALUE_COLUMNS)) + ') '
+                             'ON CONFLICT (patient_id, exam_time) DO UPDATE SET '
+                             'recorded_at = excluded.recorded_at, ulceration_risk = excluded.ulceration_risk, '
+                             'summary = excluded.summary, '
+                             + ', '.join(f'{column} = excluded.{column}' for column in VALUE_COLUMNS),
+                             (patient_id, exam_time, now, ulceration_risk, json.dumps(summary),
+                              *(values.get(name) for name, _, _ in TREND_SERIES)))
+
+                row = conn.execute('SELECT origin FROM patient_trends WHERE patient_id = ?', (patient_id,)).fetchone()
+                origin = row[0] if row is not None else exam_time
+                t = (exam_time - origin) / SECONDS_PER_YEAR
+                increments = sum_terms(t, values)
+                if recorded is not None:
+                    # Rescored exam: swap its old contribution for the new one
+                    increments = [term - old for term, old in zip(increments, sum_terms(t, recorded))]
+
+                conn.execute(
+                    'INSERT INTO patient_trends (patient_id, origin, first_time, last_time, exam_count, '
+                    + ', '.join(SUM_COLUMNS) + ') VALUES (?, ?, ?, ?, ?, '
+                    + ', '.join('?' * len(SUM_COLUMNS)) + ') '
+                    'ON CONFLICT (patient_id) DO UPDATE SET '
+                    'first_time = MIN(first_time, excluded.first_time), '
+                    'last_time = MAX(last_time, excluded.last_time), '
+                    'exam_count = exam_count + excluded.exam_count, '
+                    + ', '.join(f'{column} = {column} + excluded.{column}' for column in SUM_COLUMNS),
+                    (patient_id, origin, exam_time, exam_time, 0 if recorded is not None else 1, *increments))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def history(self, patient_id, limit=50, cursor=None):
+        """
+        One page of a patient's exams, newest first, and the cursor of the next
+        page (None on the last page). Pages are read by keyset, not offset.
+        """
+        conn = self._connect()
+        if cursor:
+            before_time, before_id = cursor.rsplit(':', 1)
+            rows = conn.execute(
+                'SELECT id, exam_time, recorded_at, ulceration_risk, summary FROM exams '
+                'WHERE patient_id = ? AND (exam_time, id) < (?, ?) '
+                'ORDER BY exam_time DESC, id DESC LIMIT ?',
+                (patient_id, float(before_time), int(before_id), limit + 1)).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT id, exam_time, recorded_at, ulceration_risk, summary FROM exams '
+                'WHERE patient_id = ? ORDER BY exam_time DESC, id DESC LIMIT ?',
+                (patient_id, limit + 1)).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f'{rows[-1][1]!r}:{rows[-1][0]}'
+
+        exams = []
+        for exam_id, exam_time, recorded_at, ulceration_risk, summary in rows:
+            exam = {
+                'exam_id': exam_id,
+                'exam_date': datetime.fromtimestamp(exam_time, timezone.utc).isoformat(),
+                'recorded_at': datetime.fromtimestamp(recorded_at, timezone.utc).isoformat(),
+                'ulceration_risk': ulceration_risk
+            }
+            exam.update(json.loads(summary))
+            exams.append(exam)
+        return exams, next_cursor
+
+def build_history_store(settings):
+    """
+    HistoryStore for the HISTORY_* settings, or None when history is disabled
+    """
+    if not settings.HISTORY_ENABLED:
+        return None
+    return HistoryStore(settings.HISTORY_PATH, settings.HISTORY_MIN_TREND_EXAMS, settings.HISTORY_MIN_TREND_DAYS)
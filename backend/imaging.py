@@ -0,0 +1,313 @@
+"""
+Foot image analysis pipeline
+
+Each image is decoded once (JPEGs at a reduced scale when they are much larger
+than max_side). The foot is located on a small thumbnail with an Otsu
+threshold and its largest contour, the image is cropped to it, and the crop is
+brought to the pyramid level whose longest side is target_side. All statistics,
+overall and for the forefoot, midfoot and rearfoot thirds of the foot, are
+computed on that one array, so after decoding the cost of an image follows the
+foot's size rather than the camera resolution, and features are computed at the
+same scale for every camera. The images of a request are
+analysed concurrently on a bounded thread pool; OpenCV and Pillow release the GIL
+while decoding and filtering, so request latency follows the slowest image rather
+than the sum of all of them.
+
+OpenCV and Pillow are imported on first use, so workers that never receive
+foot images do not pay for loading them.
+"""
+import base64
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+from metrics import METRICS, stage
+from pedoscan import REGIONS
+
+# Longest decoded image side; larger images are downscaled (0 disables)
+DEFAULT_MAX_SIDE = 1024
+
+# Longest side of the foot crop the statistics are computed on (0 keeps the crop as is)
+DEFAULT_TARGET_SIDE = 512
+
+# Foot detection: thumbnail size, margin around the detected foot (fraction of
+# its bounding box) and smallest foot area (fraction of the image) accepted
+ROI_THUMBNAIL_SIDE = 256
+ROI_MARGIN = 0.05
+MIN_ROI_FRACTION = 0.005
+MASK_KERNEL = np.ones((5, 5), dtype=np.uint8)
+
+# Statistics computed per foot region, named '{region}_{name}'
+REGION_FEATURES = (
+    'mean_intensity', 'texture_variance', 'edge_density', 'red_mean', 'green_mean', 'blue_mean', 'red_ratio'
+)
+
+# Pixel bounds of the foot in the decoded image, and the threshold that separates it from the background
+FootROI = namedtuple('FootROI', ('top', 'bottom', 'left', 'right', 'threshold', 'bright', 'area_fraction'))
+
+def image_bytes(payload):
+    """
+    Raw encoded image bytes from a base64 string (with or without a data URL
+    prefix), a bytes object, or a file-like upload
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return bytes(payload)
+    if hasattr(payload, 'read'):
+        return payload.read()
+    if ',' in payload:
+        payload = payload.split(',', 1)[1]
+    return base64.b64decode(payload)
+
+def decode_image(data, max_side=DEFAULT_MAX_SIDE, exact=True):
+    """
+    Decode an encoded image once into an RGB or grayscale uint8 array whose
+    longest side is at most max_side
+    With exact=False only the JPEG decoder's own scaling is used, which leaves
+    the longest side between max_side and twice that; callers that resample the
+    image afterwards anyway save a full-resolution resize
+    """
+    import cv2
+    from PIL import Image
+
+    img = Image.open(BytesIO(data))
+    if max_side:
+        # JPEG decoders can scale by 1/2, 1/4 or 1/8 during decoding
+        img.draft('RGB' if img.mode != 'L' else 'L', (max_side, max_side))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img_array = np.asarray(img)
+
+    height, width = img_array.shape[:2]
+    if exact and max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img_array = cv2.resize(img_array, size, interpolation=cv2.INTER_AREA)
+
+    return img_array
+
+def to_gray(img_array):
+    import cv2
+
+    return cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY) if img_array.ndim == 3 else img_array
+
+def find_foot_roi(img_array, thumbnail_side=ROI_THUMBNAIL_SIDE):
+    """
+    FootROI of the foot in img_array, found on a small thumbnail with an Otsu
+    threshold and the largest external contour; None when no foot-sized region
+    stands out from the background
+    """
+    import cv2
+
+    height, width = img_array.shape[:2]
+    scale = min(1.0, thumbnail_side / max(height, width))
+    if scale < 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img_array = cv2.resize(img_array, size, interpolation=cv2.INTER_AREA)
+    gray = cv2.GaussianBlur(to_gray(img_array), (5, 5), 0)
+    threshold, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # The foot is the class that covers less of the image border
+    border = np.concatenate((binary[0], binary[-1], binary[:, 0], binary[:, -1]))
+    bright = np.count_nonzero(border) <= border.size / 2
+    if not bright:
+        binary = cv2.bitwise_not(binary)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, MASK_KERNEL)
+
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+    area_fraction = cv2.contourArea(contour) / binary.size
+    if area_fraction < MIN_ROI_FRACTION:
+        return None
+
+    x, y, w, h = cv2.boundingRect(contour)
+    margin_x, margin_y = w * ROI_MARGIN, h * ROI_MARGIN
+    return FootROI(
+        top=max(0, int((y - margin_y) / scale)),
+        bottom=min(height, int(np.ceil((y + h + margin_y) / scale))),
+        left=max(0, int((x - margin_x) / scale)),
+        right=min(width, int(np.ceil((x + w + margin_x) / scale))),
+        threshold=threshold,
+        bright=bright,
+        area_fraction=area_fraction
+    )
+
+def analysis_level(img_array, target_side=DEFAULT_TARGET_SIDE):
+    """
+    img_array at the pyramid level whose longest side is target_side: halved
+    with pyrDown while at least twice the target, then resized to the target,
+    so features are computed at the same scale whatever the camera resolution
+    """
+    import cv2
+
+    if not target_side:
+        return img_array
+    while max(img_array.shape[:2]) >= 2 * target_side:
+        img_array = cv2.pyrDown(img_array)
+    height, width = img_array.shape[:2]
+    scale = target_side / max(height, width)
+    if scale != 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img_array = cv2.resize(img_array, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    return img_array
+
+def foot_mask(gray, roi):
+    """
+    uint8 mask of the foot pixels of a grayscale analysis image, using the
+    threshold found by find_foot_roi (the whole image when there is no ROI)
+    """
+    import cv2
+
+    if roi is None:
+        return np.full(gray.shape, 255, dtype=np.uint8)
+    mode = cv2.THRESH_BINARY if roi.bright else cv2.THRESH_BINARY_INV
+    _, mask = cv2.threshold(cv2.GaussianBlur(gray, (5, 5), 0), roi.threshold, 255, mode)
+    return cv2.morphologyEx(mask, cv2.MORPH_OPEN, MASK_KERNEL)
+
+def region_bounds(mask):
+    """
+    (axis, bounds) of the forefoot, midfoot and rearfoot thirds along the
+    foot's long axis; the forefoot is the wider end of the foot
+    """
+    axis = 0 if mask.shape[0] >= mask.shape[1] else 1
+    length = mask.shape[axis]
+    bounds = [(0, length // 3), (length // 3, 2 * length // 3), (2 * length // 3, length)]
+    profile = np.count_nonzero(mask, axis=1 - axis)
+    if profile[bounds[2][0]:].sum() > profile[:bounds[0][1]].sum():
+        bounds.reverse()
+    return axis, bounds
+
+def region_statistics(img_array, gray, laplacian, edges, mask):
+    """
+    Colour and texture statistics of the foot pixels in each region
+    """
+    import cv2
+
+    stats = {}
+    axis, bounds = region_bounds(mask)
+    for region, (start, stop) in zip(REGIONS, bounds):
+        section = (slice(start, stop), slice(None)) if axis == 0 else (slice(None), slice(start, stop))
+        region_mask = mask[section]
+        pixels = cv2.countNonZero(region_mask) if region_mask.size else 0
+        if not pixels:
+            stats.update((f'{region}_{name}', 0.0) for name in REGION_FEATURES)
+            continue
+
+        _, laplacian_std = cv2.meanStdDev(laplacian[section], mask=region_mask)
+        stats[f'{region}_mean_intensity'] = cv2.mean(gray[section], mask=region_mask)[0]
+        stats[f'{region}_texture_variance'] = float(laplacian_std[0, 0]) ** 2
+        stats[f'{region}_edge_density'] = cv2.countNonZero(cv2.bitwise_and(edges[section], region_mask)) / pixels
+        if img_array.ndim == 3:
+            red_mean, green_mean, blue_mean = cv2.mean(img_array[section], mask=region_mask)[:3]
+        else:
+            red_mean = green_mean = blue_mean = stats[f'{region}_mean_intensity']
+        stats[f'{region}_red_mean'] = red_mean
+        stats[f'{region}_green_mean'] = green_mean
+        stats[f'{region}_blue_mean'] = blue_mean
+        stats[f'{region}_red_ratio'] = red_mean / (green_mean + blue_mean + 1e-8)
+    return stats
+
+def image_statistics(img_array, roi=None):
+    """
+    Intensity, texture, edge and colour statistics of an analysis image (the
+    foot ROI at its analysis level), overall and per foot region
+    Keys are the per-image feature names without the img_{i}_ prefix
+    """
+    import cv2
+
+    is_color = img_array.ndim == 3
+    gray = to_gray(img_array)
+
+    mean, std = cv2.meanStdDev(gray)
+    min_val, max_val, _, _ = cv2.minMaxLoc(gray)
+
+    stats = {
+        'mean_intensity': float(mean[0, 0]),
+        'std_intensity': float(std[0, 0]),
+        'contrast': max_val - min_val,
+        'roi_detected': int(roi is not None),
+        'foot_area_fraction': roi.area_fraction if roi is not None else 0.0
+    }
+
+    # Texture analysis using Laplacian
+    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
+    _, laplacian_std = cv2.meanStdDev(laplacian)
+    stats['texture_variance'] = float(laplacian_std[0, 0]) ** 2
+
+    # Edge detection
+    edges = cv2.Canny(gray, 50, 150)
+    stats['edge_density'] = cv2.countNonZero(edges) / edges.size
+
+    # Colour analysis: one pass over all three channels
+    if is_color:
+        red_mean, green_mean, blue_mean = cv2.mean(img_array)[:3]
+        stats['red_mean'] = red_mean
+        stats['green_mean'] = green_mean
+        stats['blue_mean'] = blue_mean
+
+        # Color temperature indicator
+        stats['red_ratio'] = red_mean / (green_mean + blue_mean + 1e-8)
+
+    stats.update(region_statistics(img_array, gray, laplacian, edges, foot_mask(gray, roi)))
+    return stats
+
+class ImagePipeline:
+    """
+    Bounded worker pool that analyses the images of a request concurrently
+    """
+    def __init__(self, max_workers=4, max_side=DEFAULT_MAX_SIDE, target_side=DEFAULT_TARGET_SIDE, roi_enabled=True):
+        self.max_workers = max_workers
+        self.max_side = max_side
+        self.target_side = target_side
+        self.roi_enabled = roi_enabled
+        # Created on first use so the pool is never inherited across a fork
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='image')
+        return self._executor
+
+    def analyze(self, payload):
+        """
+        Decode and analyse one image payload
+        """
+        data = image_bytes(payload)
+        METRICS.observe('dfcare_payload_bytes', len(data), kind='image')
+        with stage('decode_image'):
+            # The crop is resampled to target_side below, so an exact resize here would be wasted
+            image = decode_image(data, self.max_side, exact=not self.target_side)
+        with stage('image_roi'):
+            roi = find_foot_roi(image) if self.roi_enabled else None
+            if roi is not None:
+                image = image[roi.top:roi.bottom, roi.left:roi.right]
+            image = analysis_level(image, self.target_side)
+        with stage('image_statistics'):
+            return image_statistics(image, roi)
+
+    def submit(self, payload):
+        """
+        Start analysing one image; returns a Future
+        """
+        return self.executor.submit(self.analyze, payload)
+
+    def analyze_all(self, payloads):
+        """
+        Analyse several images, returning per image either its statistics dict
+        or the exception raised while processing it, in input order
+        """
+        if len(payloads) <= 1 or self.max_workers <= 1:
+            results = []
+            for payload in payloads:
+                try:
+                    results.append(self.analyze(payload))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+        futures = [self.submit(payload) for payload in payloads]
+        return [future.exception() or future.result() for future in futures]
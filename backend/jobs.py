@@ -0,0 +1,188 @@
+"""
+Background prediction jobs with a persistent job store
+
+POST /predict/jobs hands the parsed exam to a JobRunner, which records the job
+in a JobStore and runs it on a local thread pool; GET /predict/jobs/<id> reads
+the job back from the store. The store is a SQLite file shared by every worker
+process on the host (a stand-in for the PostgreSQL service in
+docker-compose.yml), so a job can be polled through any worker. Finished jobs
+are deleted once they are older than the result TTL.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import ServiceOverloaded
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobStore:
+    """
+    SQLite table of jobs with their status and JSON result
+    """
+    # Delete expired jobs every this many submissions
+    EVICTION_INTERVAL = 32
+
+    def __init__(self, path, result_ttl=3600):
+        self.path = path
+        self.result_ttl = result_ttl
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, pid INTEGER NOT NULL, '
+                         'created REAL NOT NULL, started REAL, finished REAL, result TEXT, error TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)')
+
+    def _connect(self):
+        # One connection per thread and process; connections must not cross a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, kind):
+        job_id = uuid.uuid4().hex
+        self._connect().execute('INSERT INTO jobs (id, kind, status, pid, created) VALUES (?, ?, ?, ?, ?)',
+                                (job_id, kind, QUEUED, os.getpid(), time.time()))
+        self._writes += 1
+        if self._writes % self.EVICTION_INTERVAL == 0:
+            self.evict()
+        return job_id
+
+    def mark_running(self, job_id):
+        self._connect().execute('UPDATE jobs SET status = ?, started = ? WHERE id = ?',
+                                (RUNNING, time.time(), job_id))
+
+    def finish(self, job_id, result=None, error=None):
+        self._connect().execute(
+            'UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE id = ?',
+            (FAILED if error is not None else SUCCEEDED, time.time(),
+             None if result is None else json.dumps(result), error, job_id))
+
+    def get(self, job_id):
+        """
+        Job as a response dict, or None when it does not exist or has expired
+        """
+        row = self._connect().execute(
+            'SELECT kind, status, pid, created, started, finished, result, error FROM jobs WHERE id = ?',
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        kind, status, pid, created, started, finished, result, error = row
+
+        if finished is not None and finished < time.time() - self.result_ttl:
+            return None
+        if status in (QUEUED, RUNNING) and not _pid_alive(pid):
+            # The worker process that owned the job has exited
+            status, error = FAILED, 'Job was interrupted by a worker restart'
+            self.finish(job_id, error=error)
+
+        job = {
+            'job_id': job_id,
+            'kind': kind,
+            'status': status,
+            'created_at': created,
+            'started_at': started,
+            'finished_at': finished
+        }
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def evict(self):
+        """
+        Delete jobs that finished more than result_ttl seconds ago
+        """
+        self._connect().execute('DELETE FROM jobs WHERE finished < ?', (time.time() - self.result_ttl,))
+
+    def counts(self):
+        return dict(self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+class JobRunner:
+    """
+    Runs jobs on a local thread pool and records them in a JobStore
+    At most max_pending jobs of this process may be queued or running.
+    """
+    def __init__(self, store, max_workers=2, max_pending=32):
+        self.store = store
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # Created lazily so gunicorn workers do not inherit pool threads across fork
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+            self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, kind, func, *args):
+        """
+        Record a job and run func(*args) in the background; returns the job id
+        func must return a JSON-serialisable result
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise ServiceOverloaded('Too many pending jobs, retry later', status=429)
+            self.pending += 1
+
+        try:
+            job_id = self.store.create(kind)
+            self._get_executor().submit(self._run, job_id, func, args)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            raise
+        return job_id
+
+    def _run(self, job_id, func, args):
+        try:
+            self.store.mark_running(job_id)
+            try:
+                result = func(*args)
+            except Exception as e:
+                self.store.finish(job_id, error=str(e))
+            else:
+                self.store.finish(job_id, result=result)
+        except Exception:
+            logger.exception('Error recording job %s', job_id)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+def build_job_runner(settings):
+    """
+    JobRunner for the JOB_* settings
+    """
+    store = JobStore(settings.JOB_STORE_PATH, settings.JOB_RESULT_TTL)
+    return JobRunner(store, settings.JOB_WORKERS, settings.JOB_MAX_PENDING)
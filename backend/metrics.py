@@ -0,0 +1,269 @@
+"""
+Low-overhead pipeline metrics with a Prometheus text endpoint
+
+Every process records counters and fixed-bucket histograms in memory. A daemon
+thread writes the process' snapshot to METRICS_DIR/<pid>.json whenever it has
+changed, and /metrics merges the snapshots of all processes, so the counts are
+correct whichever gunicorn worker serves the scrape. Empty METRICS_DIR when the
+service is redeployed.
+
+SamplingProfiler captures folded stacks (flame graph input) for one request.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from functools import wraps
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(9))  # 1 KiB .. 64 MiB
+CELLS_BUCKETS = tuple(256 * 4 ** i for i in range(9))  # 16x16 .. 2048x2048
+
+# name: (type, help, buckets)
+METRIC_TYPES = {
+    'dfcare_request_seconds': ('histogram', 'HTTP request latency by endpoint', LATENCY_BUCKETS),
+    'dfcare_requests_total': ('counter', 'HTTP responses by endpoint and status', None),
+    'dfcare_stage_seconds': ('histogram', 'Latency of each prediction pipeline stage', LATENCY_BUCKETS),
+    'dfcare_payload_bytes': ('histogram', 'Size of request bodies and uploaded images', BYTES_BUCKETS),
+    'dfcare_pressure_matrix_cells': ('histogram', 'Cells per pedoscan pressure matrix or recording', CELLS_BUCKETS),
+    'dfcare_feature_cache_total': ('counter', 'Feature cache lookups by modality and result', None),
+    'dfcare_scored_exams_total': ('counter', 'Exams scored by the trained model or the heuristic', None),
+    'dfcare_image_errors_total': ('counter', 'Foot images that could not be analysed', None),
+    'dfcare_overloaded_total': ('counter', 'Requests rejected for capacity by status', None)
+}
+
+class MetricsRegistry:
+    """
+    Counters and histograms of one process, keyed by metric name and labels
+    """
+    def __init__(self):
+        self.directory = None
+        self.flush_interval = 1.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._version = 0
+        self._flusher_pid = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._version += 1
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRIC_TYPES[name][2]
+        # First bucket the value fits in; len(buckets) is +Inf
+        index = bisect_left(buckets, value)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+            self._version += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(counts), total, count]
+                               for (name, labels), (counts, total, count) in self._histograms.items()]
+            }
+
+    def configure(self, directory, flush_interval=1.0):
+        """
+        Share this process' metrics through snapshot files in directory
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def ensure_flusher(self):
+        # Started lazily in each process: threads do not survive a fork
+        if self.directory and self._flusher_pid != os.getpid():
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        flushed = None
+        while True:
+            time.sleep(self.flush_interval)
+            if self._version != flushed:
+                flushed = self._version
+                self.flush()
+
+    def flush(self):
+        """
+        Write this process' snapshot atomically
+        """
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        temp_path = f'{path}.tmp'
+        with self._flush_lock:
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, path)
+
+    def collect(self):
+        """
+        Snapshots of every process sharing the directory, this one up to date
+        """
+        if not self.directory:
+            return [self.snapshot()]
+
+        self.flush()
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed or replaced while listing
+                continue
+        return snapshots
+
+METRICS = MetricsRegistry()
+
+class stage:
+    """
+    Context manager recording the duration of one pipeline stage
+    """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        METRICS.observe('dfcare_stage_seconds', time.perf_counter() - self.start, stage=self.name)
+        return False
+
+def timed(func):
+    """
+    Record each call of func as a pipeline stage named after it
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            METRICS.observe('dfcare_stage_seconds', time.perf_counter() - start, stage=name)
+    return wrapper
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+def render_prometheus(snapshots):
+    """
+    Prometheus text exposition of merged snapshots
+    """
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.get(key)
+            if merged is None or len(merged[0]) != len(counts):
+                histograms[key] = [list(counts), total, count]
+            else:
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRIC_TYPES.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (series, labels), value in sorted(counters.items()):
+                if series == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            continue
+
+        for (series, labels), (counts, total, count) in sorted(histograms.items()):
+            if series != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels, ("le", bound))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads of the process every interval seconds
+    while running and aggregates them as folded stacks ('thread;outer;...;inner count')
+    """
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def write(self, directory, label):
+        """
+        Save the folded stacks to directory; returns the file path
+        """
+        os.makedirs(directory, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() else '_' for c in label).strip('_')
+        path = os.path.join(directory, f'{int(time.time() * 1000)}-{os.getpid()}-{safe_label}.folded')
+        with open(path, 'w') as f:
+            f.write(self.folded())
+        return path
@@ -0,0 +1,241 @@
+"""
+Trained ulceration model: training, versioned artifacts and warm loading
+
+Artifacts are written uncompressed with joblib so they can be loaded with
+mmap_mode='r'. Workers share the model by forking from a gunicorn master
+that preloaded it (see gunicorn.conf.py), not through the mapping.
+
+Usage:
+    python model_store.py train exams.csv [--model-dir DIR] [--label ulcerated]
+    python model_store.py info [--model-dir DIR]
+
+The training file (CSV or Parquet) has one row per historical exam with the
+columns of MODEL_FEATURE_NAMES (missing columns take their defaults) and a 0/1
+label column.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from features import FEATURE_SCHEMA, FeatureMatrix, FeatureVector, as_feature_vector
+from metrics import METRICS
+
+ARTIFACT_PREFIX = 'ulceration-'
+ARTIFACT_SUFFIX = '.joblib'
+
+# Model input: fixed feature order; missing features take their schema defaults
+MODEL_FEATURE_NAMES = (
+    'mono_risk_score', 'mono_tactile_sensation', 'mono_affected_points',
+    'vibration_risk_score', 'vibration_threshold', 'vibration_affected_points',
+    'hot_risk_score', 'hot_threshold', 'cold_risk_score', 'cold_threshold',
+    'overall_neuropathy_score',
+    'max_pressure', 'mean_pressure', 'pressure_variance', 'pressure_std',
+    'high_pressure_area', 'high_pressure_percentage',
+    'forefoot_max_pressure', 'forefoot_mean_pressure',
+    'midfoot_max_pressure', 'midfoot_mean_pressure',
+    'rearfoot_max_pressure', 'rearfoot_mean_pressure',
+    'pressure_gradient_magnitude', 'cop_x', 'cop_y',
+    'abi_right', 'abi_left', 'abi_average', 'abi_asymmetry',
+    'tbi_right', 'tbi_left', 'tbi_average', 'tbi_asymmetry',
+    'arm_pressure_right', 'arm_pressure_left',
+    'ankle_pressure_right', 'ankle_pressure_left',
+    'toe_pressure_right', 'toe_pressure_left',
+    'pressure_gradient_right', 'pressure_gradient_left',
+    'vascular_risk_score'
+)
+MODEL_FEATURE_INDEX = FEATURE_SCHEMA.indices(MODEL_FEATURE_NAMES)
+
+def model_feature_matrix(features):
+    """
+    (n_exams, n_features) model input, in MODEL_FEATURE_NAMES order, from a
+    FeatureMatrix, a FeatureVector or a list of feature mappings
+    """
+    if isinstance(features, FeatureMatrix):
+        return features.values[:, MODEL_FEATURE_INDEX]
+    if isinstance(features, FeatureVector):
+        return features.values[MODEL_FEATURE_INDEX][None, :]
+
+    matrix = np.empty((len(features), len(MODEL_FEATURE_NAMES)))
+    for row, mapping in enumerate(features):
+        matrix[row] = as_feature_vector(mapping).values[MODEL_FEATURE_INDEX]
+    return matrix
+
+class UlcerationModel:
+    """
+    Loaded model artifact with load and inference timings
+    """
+    def __init__(self, estimator, metadata, path, load_seconds):
+        self.estimator = estimator
+        self.metadata = metadata
+        self.path = path
+        self.load_seconds = load_seconds
+        self.batches = 0
+        self.rows = 0
+        self.inference_seconds = 0.0
+        self.last_batch_seconds = 0.0
+
+    @property
+    def version(self):
+        return self.metadata['version']
+
+    def predict_risk(self, feature_matrix):
+        """
+        Ulceration probability for each row of a model_feature_matrix
+        """
+        start = time.perf_counter()
+        risk = self.estimator.predict_proba(feature_matrix)[:, 1]
+        elapsed = time.perf_counter() - start
+
+        self.batches += 1
+        self.rows += len(feature_matrix)
+        self.inference_seconds += elapsed
+        self.last_batch_seconds = elapsed
+        METRICS.observe('dfcare_stage_seconds', elapsed, stage='model_inference')
+        return risk
+
+    def info(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'metadata': self.metadata,
+            'load_seconds': self.load_seconds,
+            'batches': self.batches,
+            'rows': self.rows,
+            'inference_seconds': self.inference_seconds,
+            'last_batch_seconds': self.last_batch_seconds,
+            'mean_batch_seconds': self.inference_seconds / self.batches if self.batches else 0.0
+        }
+
+def artifact_paths(model_dir):
+    """
+    Model artifacts in model_dir, oldest version first
+    """
+    return sorted(glob.glob(os.path.join(model_dir, f'{ARTIFACT_PREFIX}*{ARTIFACT_SUFFIX}')))
+
+def load_model(path, mmap_mode='r'):
+    """
+    Load one artifact; numpy arrays are read through a memory map when
+    mmap_mode is set (scikit-learn copies the tree arrays out of it)
+    """
+    import joblib
+
+    start = time.perf_counter()
+    artifact = joblib.load(path, mmap_mode=mmap_mode)
+    load_seconds = time.perf_counter() - start
+
+    if tuple(artifact['metadata']['features']) != MODEL_FEATURE_NAMES:
+        raise ValueError(f'{path} was trained on a different feature set')
+
+    return UlcerationModel(artifact['estimator'], artifact['metadata'], path, load_seconds)
+
+def load_latest_model(model_dir, mmap_mode='r'):
+    """
+    Newest artifact in model_dir, or None when no model has been trained
+    """
+    paths = artifact_paths(model_dir)
+    if not paths:
+        return None
+    return load_model(paths[-1], mmap_mode)
+
+def read_training_table(data_path):
+    """
+    Historical exams from a CSV or Parquet file
+    """
+    import pandas as pd
+
+    if data_path.endswith(('.parquet', '.pq')):
+        return pd.read_parquet(data_path)
+    return pd.read_csv(data_path)
+
+def train_model(data_path, model_dir, label_column='ulcerated', n_estimators=200, random_state=42):
+    """
+    Train the ulceration classifier on a table of historical exams and write a
+    new versioned artifact. Returns the artifact path.
+    """
+    import joblib
+    import sklearn
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    table = read_training_table(data_path)
+    if label_column not in table.columns:
+        raise ValueError(f'Label column {label_column!r} not found in {data_path}')
+
+    defaults = FEATURE_SCHEMA.defaults[MODEL_FEATURE_INDEX]
+    features = np.column_stack([
+        table[name].fillna(default).to_numpy(dtype=np.float64) if name in table.columns
+        else np.full(len(table), default)
+        for name, default in zip(MODEL_FEATURE_NAMES, defaults)
+    ])
+    labels = table[label_column].to_numpy().astype(int)
+
+    start = time.perf_counter()
+    estimator = make_pipeline(
+        StandardScaler(),
+        RandomForestClassifier(n_estimators=n_estimators, oob_score=True, n_jobs=-1, random_state=random_state)
+    )
+    estimator.fit(features, labels)
+    # Predictions are made from a single request thread per worker
+    estimator[-1].set_params(n_jobs=1)
+
+    trained_at = datetime.now(timezone.utc)
+    version = trained_at.strftime('%Y%m%d%H%M%S')
+    metadata = {
+        'version': version,
+        'trained_at': trained_at.isoformat(),
+        'training_data': os.path.basename(data_path),
+        'label_column': label_column,
+        'n_samples': int(len(labels)),
+        'positive_rate': float(labels.mean()) if len(labels) else 0.0,
+        'oob_accuracy': float(estimator[-1].oob_score_),
+        'training_seconds': time.perf_counter() - start,
+        'features': list(MODEL_FEATURE_NAMES),
+        'sklearn_version': sklearn.__version__
+    }
+
+    os.makedirs(model_dir, exist_ok=True)
+    path = os.path.join(model_dir, f'{ARTIFACT_PREFIX}v{version}{ARTIFACT_SUFFIX}')
+    # Uncompressed so the artifact can be memory-mapped on load
+    joblib.dump({'estimator': estimator, 'metadata': metadata}, path, compress=0)
+
+    return path
+
+def main(argv=None):
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Train and inspect ulceration model artifacts')
+    parser.add_argument('--model-dir', default=Config.MODEL_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    train = commands.add_parser('train', help='train a new model version')
+    train.add_argument('data_path', help='CSV or Parquet file of historical exams')
+    train.add_argument('--label', default='ulcerated', help='0/1 ulceration outcome column')
+    train.add_argument('--n-estimators', type=int, default=200)
+
+    commands.add_parser('info', help='describe the latest model version')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        path = train_model(args.data_path, args.model_dir, args.label, args.n_estimators)
+        print(f'Wrote {path}')
+
+    model = load_latest_model(args.model_dir)
+    if model is None:
+        print(f'No model artifacts in {args.model_dir}')
+        return 1
+
+    # Time one inference batch on default-valued rows
+    model.predict_risk(model_feature_matrix(FEATURE_SCHEMA.new_matrix(256)))
+    print(json.dumps(model.info(), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
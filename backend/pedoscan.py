@@ -0,0 +1,331 @@
+"""
+Pedoscan pressure statistics kernel
+
+All statistics are derived from a handful of row-level reductions over the
+pressure matrix (row max, row sums, contact and high-pressure counts), so the
+global and regional features need no further passes, masks or slice copies.
+Region boundaries and coordinate vectors are cached per grid shape, and many
+matrices of the same shape are processed together as one (n, height, width) stack.
+Bilateral exams (one matrix per foot) go through the same stacks: both feet are
+reduced in one kernel call and bilateral_features combines their statistics.
+Dynamic (gait) recordings are reduced frame by frame with GaitSequenceAccumulator.
+"""
+from array import array
+from functools import lru_cache
+
+import numpy as np
+
+HIGH_PRESSURE_THRESHOLD = 200  # kPa
+
+REGIONS = ('forefoot', 'midfoot', 'rearfoot')
+
+# Cells per stacked batch; keeps the kernel's temporaries cache-resident for large grids
+MAX_STACK_CELLS = 1 << 16
+# Cells in one pressure grid; larger grids are rejected before anything is allocated for them
+MAX_GRID_CELLS = 1 << 20
+
+FEATURE_NAMES = (
+    'max_pressure', 'mean_pressure', 'pressure_variance', 'pressure_std',
+    'high_pressure_area', 'high_pressure_percentage',
+    'forefoot_max_pressure', 'forefoot_mean_pressure',
+    'midfoot_max_pressure', 'midfoot_mean_pressure',
+    'rearfoot_max_pressure', 'rearfoot_mean_pressure',
+    'pressure_gradient_magnitude', 'cop_x', 'cop_y'
+)
+
+# Labels of the matrices of a bilateral exam; per-foot features are named '{side}_{name}'
+FOOT_SIDES = ('left', 'right')
+
+ASYMMETRY_FEATURE_NAMES = ('peak_pressure_ratio', 'peak_pressure_asymmetry', 'cop_offset_x', 'cop_offset_y')
+
+@lru_cache(maxsize=64)
+def region_layout(height, width):
+    """
+    Row bounds of the forefoot (top 1/3), midfoot and rearfoot (bottom 1/3)
+    regions, and the x / y coordinate vectors, for one grid shape
+    """
+    bounds = ((0, height // 3), (height // 3, 2 * height // 3), (2 * height // 3, height))
+    x_coords = np.arange(width, dtype=np.float64)
+    y_coords = np.arange(height, dtype=np.float64)
+    x_coords.flags.writeable = False
+    y_coords.flags.writeable = False
+    return bounds, x_coords, y_coords
+
+def _safe_divide(numerator, denominator):
+    """
+    Elementwise numerator / denominator, 0 where the denominator is 0
+    """
+    return np.divide(numerator, denominator, out=np.zeros(np.shape(numerator)), where=denominator != 0)
+
+def _gradient_magnitude(stack):
+    """
+    Mean magnitude of the np.gradient of each matrix in the stack, computed with
+    in-place differences instead of np.gradient / np.hypot temporaries
+    """
+    n, height, width = stack.shape
+    if stack.dtype.kind != 'f':
+        stack = stack.astype(np.float64)
+    grad_x = np.empty(stack.shape)
+    grad_y = np.empty(stack.shape)
+
+    # Central differences inside, one-sided differences at the edges
+    np.subtract(stack[:, :, 2:], stack[:, :, :-2], out=grad_x[:, :, 1:-1])
+    grad_x[:, :, 1:-1] *= 0.5
+    np.subtract(stack[:, :, 1], stack[:, :, 0], out=grad_x[:, :, 0])
+    np.subtract(stack[:, :, -1], stack[:, :, -2], out=grad_x[:, :, -1])
+
+    np.subtract(stack[:, 2:], stack[:, :-2], out=grad_y[:, 1:-1])
+    grad_y[:, 1:-1] *= 0.5
+    np.subtract(stack[:, 1], stack[:, 0], out=grad_y[:, 0])
+    np.subtract(stack[:, -1], stack[:, -2], out=grad_y[:, -1])
+
+    np.multiply(grad_x, grad_x, out=grad_x)
+    np.multiply(grad_y, grad_y, out=grad_y)
+    grad_x += grad_y
+    np.sqrt(grad_x, out=grad_x)
+
+    return grad_x.reshape(n, -1).sum(axis=1) / (height * width)
+
+def pedoscan_statistics_batch(stack):
+    """
+    Pedoscan statistics for a (n, height, width) stack of same-shape pressure
+    matrices. Returns a dict of FEATURE_NAMES -> float64 arrays of length n.
+    Matrices without contact (no cell > 0) get 0 for contact-based means.
+    """
+    stack = np.asarray(stack)
+    if stack.ndim == 2:
+        stack = stack[None]
+    n, height, width = stack.shape
+    cells = height * width
+    bounds, x_coords, y_coords = region_layout(height, width)
+
+    # Row-level reductions; everything below is derived from these (n, height) arrays
+    contact = stack > 0
+    row_max = stack.max(axis=2).astype(np.float64)
+    row_sum = stack.sum(axis=2, dtype=np.float64)
+    row_sq_sum = np.einsum('nhw,nhw->nh', stack, stack, dtype=np.float64)
+    row_contact_sum = np.einsum('nhw,nhw->nh', stack, contact, dtype=np.float64)
+    row_contact = np.count_nonzero(contact, axis=2)
+    row_high = np.count_nonzero(stack > HIGH_PRESSURE_THRESHOLD, axis=2)
+    column_sum = stack.sum(axis=1, dtype=np.float64)
+
+    features = {}
+
+    # Basic pressure statistics
+    total_pressure = row_sum.sum(axis=1)
+    contact_cells = row_contact.sum(axis=1)
+    mean = total_pressure / cells
+    variance = np.maximum(row_sq_sum.sum(axis=1) / cells - mean * mean, 0)
+    features['max_pressure'] = row_max.max(axis=1)
+    features['mean_pressure'] = _safe_divide(row_contact_sum.sum(axis=1), contact_cells)
+    features['pressure_variance'] = variance
+    features['pressure_std'] = np.sqrt(variance)
+
+    # High pressure region analysis
+    features['high_pressure_area'] = row_high.sum(axis=1).astype(np.float64)
+    features['high_pressure_percentage'] = _safe_divide(features['high_pressure_area'], contact_cells) * 100
+
+    # Regional pressure analysis
+    for region, (start, stop) in zip(REGIONS, bounds):
+        if stop > start:
+            features[f'{region}_max_pressure'] = row_max[:, start:stop].max(axis=1)
+            features[f'{region}_mean_pressure'] = _safe_divide(
+                row_contact_sum[:, start:stop].sum(axis=1), row_contact[:, start:stop].sum(axis=1))
+        else:
+            features[f'{region}_max_pressure'] = np.zeros(n)
+            features[f'{region}_mean_pressure'] = np.zeros(n)
+
+    # Pressure gradient analysis
+    if height > 1 and width > 1:
+        features['pressure_gradient_magnitude'] = _gradient_magnitude(stack)
+    else:
+        features['pressure_gradient_magnitude'] = np.zeros(n)
+
+    # Center of pressure from the row / column marginals
+    features['cop_x'] = _safe_divide(column_sum @ x_coords, np.where(total_pressure > 0, total_pressure, 0))
+    features['cop_y'] = _safe_divide(row_sum @ y_coords, np.where(total_pressure > 0, total_pressure, 0))
+
+    return features
+
+def pedoscan_statistics(pressure_matrix):
+    """
+    Pedoscan statistics of one 2-D pressure matrix as a dict of floats
+    """
+    return {name: float(values[0]) for name, values in pedoscan_statistics_batch(pressure_matrix).items()}
+
+def pedoscan_statistics_many(pressure_matrices):
+    """
+    Pedoscan statistics for matrices of possibly different shapes; matrices of
+    the same shape are stacked and processed together. Returns one dict per matrix.
+    """
+    results = [None] * len(pressure_matrices)
+    by_shape = {}
+    for i, matrix in enumerate(pressure_matrices):
+        by_shape.setdefault(matrix.shape, []).append(i)
+
+    for (height, width), indices in by_shape.items():
+        chunk_size = max(1, MAX_STACK_CELLS // (height * width))
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            batch = pedoscan_statistics_batch(np.stack([pressure_matrices[i] for i in chunk]))
+            rows = np.column_stack([batch[name] for name in FEATURE_NAMES]).tolist()
+            for i, row in zip(chunk, rows):
+                results[i] = dict(zip(FEATURE_NAMES, row))
+
+    return results
+
+def bilateral_features(statistics, shapes):
+    """
+    Features of a bilateral exam from the statistics and grid shape of each
+    foot (dicts keyed by side). The unprefixed features are those of the worst
+    foot, the one with the highest peak pressure, so single-matrix and
+    bilateral exams are scored alike; asymmetry features need both feet.
+    """
+    features = {}
+    for side in FOOT_SIDES:
+        if side in statistics:
+            features.update((f'{side}_{name}', value) for name, value in statistics[side].items())
+
+    worst = max((side for side in FOOT_SIDES if side in statistics), key=lambda side: statistics[side]['max_pressure'])
+    features.update(statistics[worst])
+    if len(statistics) < len(FOOT_SIDES):
+        return features
+
+    # Peak pressure ratio (higher over lower foot, 0 when one foot has no load)
+    # and symmetry index (difference over mean, in %)
+    left, right = statistics['left']['max_pressure'], statistics['right']['max_pressure']
+    features['peak_pressure_ratio'] = max(left, right) / min(left, right) if min(left, right) > 0 else 0.0
+    features['peak_pressure_asymmetry'] = 200 * abs(left - right) / (left + right) if left + right > 0 else 0.0
+
+    # Centre of pressure offset (right minus left) in fractions of each grid's width / height
+    (left_height, left_width), (right_height, right_width) = shapes['left'], shapes['right']
+    features['cop_offset_x'] = statistics['right']['cop_x'] / right_width - statistics['left']['cop_x'] / left_width
+    features['cop_offset_y'] = statistics['right']['cop_y'] / right_height - statistics['left']['cop_y'] / left_height
+
+    return features
+
+class GaitSequenceAccumulator:
+    """
+    Running statistics over a walking sequence of pressure frames
+
+    Frames can be fed one at a time or in chunks; only the peak-pressure map,
+    the pressure-time integral and a few floats per frame (centre of pressure,
+    regional loads) are kept, so sequences never sit in memory as a whole.
+    """
+    def __init__(self, frame_shape, frame_rate=100.0):
+        if frame_rate <= 0:
+            raise ValueError('frame_rate must be positive')
+        self.frame_shape = tuple(int(dim) for dim in frame_shape)
+        if len(self.frame_shape) != 2 or self.frame_shape[0] * self.frame_shape[1] > MAX_GRID_CELLS:
+            raise ValueError(f'Invalid gait frame shape: {self.frame_shape}')
+        self.frame_rate = float(frame_rate)
+        self.frame_count = 0
+        self.peak_map = np.zeros(self.frame_shape)
+        self.pressure_time_integral = np.zeros(self.frame_shape)  # kPa*s
+        self._cop = array('d')       # x, y per frame
+        self._regional = array('d')  # forefoot, midfoot, rearfoot load per frame
+        self._total = array('d')     # total load per frame
+
+    def update(self, frames):
+        """
+        Add one (height, width) frame or a (n, height, width) chunk of frames
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[None]
+        if frames.shape[1:] != self.frame_shape:
+            raise ValueError(f'Frame shape {frames.shape[1:]} does not match {self.frame_shape}')
+        if not len(frames):
+            return
+
+        bounds, x_coords, y_coords = region_layout(*self.frame_shape)
+
+        np.maximum(self.peak_map, frames.max(axis=0), out=self.peak_map)
+        self.pressure_time_integral += frames.sum(axis=0, dtype=np.float64) / self.frame_rate
+
+        # Per-frame marginals give the centre of pressure and regional loads
+        row_sum = frames.sum(axis=2, dtype=np.float64)
+        column_sum = frames.sum(axis=1, dtype=np.float64)
+        total = row_sum.sum(axis=1)
+        loaded = np.where(total > 0, total, 0)
+        cop = np.column_stack([_safe_divide(column_sum @ x_coords, loaded),
+                               _safe_divide(row_sum @ y_coords, loaded)])
+        regional = np.column_stack([row_sum[:, start:stop].sum(axis=1) for start, stop in bounds])
+
+        self._cop.frombytes(cop.tobytes())
+        self._regional.frombytes(regional.tobytes())
+        self._total.frombytes(total.tobytes())
+        self.frame_count += len(frames)
+
+    def cop_trajectory(self):
+        """
+        (frames, 2) centre of pressure trajectory (x, y)
+        """
+        return np.frombuffer(self._cop, dtype=np.float64).reshape(-1, 2)
+
+    def regional_loading(self):
+        """
+        (frames, 3) summed pressure per region (forefoot, midfoot, rearfoot)
+        """
+        return np.frombuffer(self._regional, dtype=np.float64).reshape(-1, len(REGIONS))
+
+    def features(self):
+        """
+        Static pedoscan features of the peak-pressure map plus gait features
+        """
+        if not self.frame_count:
+            raise ValueError('No pressure frames received')
+
+        features = pedoscan_statistics(self.peak_map)
+        dt = 1 / self.frame_rate
+        in_contact = np.frombuffer(self._total, dtype=np.float64) > 0
+
+        features['frame_count'] = float(self.frame_count)
+        features['duration_s'] = self.frame_count * dt
+        features['contact_time_s'] = float(np.count_nonzero(in_contact)) * dt
+
+        # Pressure-time integral
+        pti_contact = self.pressure_time_integral > 0
+        features['pti_max'] = float(self.pressure_time_integral.max())
+        features['pti_mean'] = float(self.pressure_time_integral[pti_contact].mean()) if pti_contact.any() else 0.0
+
+        # Centre of pressure trajectory over the frames with contact
+        cop = self.cop_trajectory()[in_contact]
+        if len(cop):
+            features['cop_path_length'] = float(np.sqrt((np.diff(cop, axis=0) ** 2).sum(axis=1)).sum())
+            features['cop_excursion_x'] = float(np.ptp(cop[:, 0]))
+            features['cop_excursion_y'] = float(np.ptp(cop[:, 1]))
+        else:
+            features['cop_path_length'] = features['cop_excursion_x'] = features['cop_excursion_y'] = 0.0
+
+        # Regional loading curves
+        regional = self.regional_loading()
+        for column, region in enumerate(REGIONS):
+            features[f'{region}_peak_load'] = float(regional[:, column].max())
+            features[f'{region}_load_impulse'] = float(regional[:, column].sum()) * dt
+
+        return features
+
+    def curves(self):
+        """
+        Per-frame curves for plotting: time, centre of pressure and regional loads
+        """
+        curves = {
+            'time_s': (np.arange(self.frame_count) / self.frame_rate).tolist(),
+            'cop_x': self.cop_trajectory()[:, 0].tolist(),
+            'cop_y': self.cop_trajectory()[:, 1].tolist()
+        }
+        regional = self.regional_loading()
+        for column, region in enumerate(REGIONS):
+            curves[f'{region}_load'] = regional[:, column].tolist()
+        return curves
+
+def gait_sequence_features(frames, frame_rate=100.0, frames_per_chunk=256):
+    """
+    Gait features of a (frames, height, width) array, e.g. a memory-mapped
+    recording; frames are read frames_per_chunk at a time
+    """
+    accumulator = GaitSequenceAccumulator(frames.shape[1:], frame_rate)
+    for start in range(0, frames.shape[0], frames_per_chunk):
+        accumulator.update(frames[start:start + frames_per_chunk])
+    return accumulator.features()
@@ -0,0 +1,178 @@
+"""
+Pedoscan pressure matrix decoding
+
+Besides the JSON list-of-lists format, pressure matrices can arrive as compact
+binary payloads that are mapped straight into an ndarray with np.frombuffer,
+without creating a Python object per cell:
+- raw:     8-byte header of two little-endian uint32 (height, width) followed by
+           height * width little-endian float32 values
+- npy:     a NumPy .npy file
+- encoded: {'shape': [h, w], 'dtype': '<f4', 'data': <bytes or base64 string>},
+           e.g. inside a msgpack exam (bin payload) or a JSON exam (base64)
+Gait recordings use the same encodings with a leading frame axis
+(frames, height, width); raw frame streams carry the (height, width) header once,
+followed by any number of float32 frames.
+"""
+import base64
+import struct
+from io import BytesIO
+
+import numpy as np
+
+from pedoscan import MAX_GRID_CELLS
+
+RAW_CONTENT_TYPE = 'application/x-pressure-f32'
+NPY_CONTENT_TYPE = 'application/x-npy'
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+RAW_HEADER = struct.Struct('<II')
+NPY_MAGIC = b'\x93NUMPY'
+
+# Element types accepted in binary payloads
+ALLOWED_DTYPES = {'<f4', '<f8', '|u1', '<u2', '<i2', '<i4'}
+
+def _check_shape(shape, ndim=2):
+    if len(shape) != ndim or any(dim <= 0 for dim in shape):
+        raise ValueError(f'Invalid pressure matrix shape: {tuple(shape)}')
+    if shape[-2] * shape[-1] > MAX_GRID_CELLS:
+        raise ValueError(f'Pressure grid {shape[-2]}x{shape[-1]} exceeds {MAX_GRID_CELLS} cells')
+
+def _frombuffer(buffer, dtype, shape, offset=0, order='C', ndim=2):
+    dtype = np.dtype(dtype)
+    if dtype.str not in ALLOWED_DTYPES:
+        raise ValueError(f'Unsupported pressure matrix dtype: {dtype.str}')
+    shape = tuple(int(dim) for dim in shape)
+    _check_shape(shape, ndim)
+
+    count = int(np.prod(shape))
+    if len(buffer) - offset != count * dtype.itemsize:
+        raise ValueError(f'Pressure matrix payload has {len(buffer) - offset} bytes, '
+                         f'expected {count * dtype.itemsize} for shape {shape}')
+
+    return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape, order=order)
+
+def decode_raw(buffer):
+    """
+    Raw little-endian float32 matrix with a (height, width) uint32 header
+    """
+    if len(buffer) < RAW_HEADER.size:
+        raise ValueError('Pressure matrix payload is shorter than its header')
+    height, width = RAW_HEADER.unpack_from(buffer)
+    return _frombuffer(buffer, '<f4', (height, width), offset=RAW_HEADER.size)
+
+def encode_raw(matrix):
+    """
+    Inverse of decode_raw
+    """
+    matrix = np.ascontiguousarray(matrix, dtype='<f4')
+    return RAW_HEADER.pack(*matrix.shape) + matrix.tobytes()
+
+def decode_npy(buffer, ndim=2):
+    """
+    NumPy .npy payload, mapped without copying the array data
+    """
+    stream = BytesIO(buffer)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype.hasobject:
+        raise ValueError('Object arrays are not accepted')
+
+    return _frombuffer(buffer, dtype, shape, offset=stream.tell(), order='F' if fortran_order else 'C', ndim=ndim)
+
+def decode_bytes(buffer):
+    """
+    Binary payload in .npy or raw float32 format
+    """
+    buffer = bytes(buffer) if isinstance(buffer, memoryview) else buffer
+    if buffer[:len(NPY_MAGIC)] == NPY_MAGIC:
+        return decode_npy(buffer)
+    return decode_raw(buffer)
+
+def decode_frames(buffer):
+    """
+    (frames, height, width) stack from a .npy payload or a raw float32 frame stream
+    """
+    buffer = bytes(buffer) if isinstance(buffer, memoryview) else buffer
+    if buffer[:len(NPY_MAGIC)] == NPY_MAGIC:
+        return decode_npy(buffer, ndim=3)
+    if len(buffer) < RAW_HEADER.size:
+        raise ValueError('Pressure frame payload is shorter than its header')
+    height, width = RAW_HEADER.unpack_from(buffer)
+    frame_bytes = height * width * 4
+    if not frame_bytes or (len(buffer) - RAW_HEADER.size) % frame_bytes:
+        raise ValueError(f'Pressure frame payload is not a whole number of {height}x{width} frames')
+    frames = (len(buffer) - RAW_HEADER.size) // frame_bytes
+    return _frombuffer(buffer, '<f4', (frames, height, width), offset=RAW_HEADER.size, ndim=3)
+
+def iter_raw_frames(stream, frames_per_chunk=64):
+    """
+    Read a raw float32 frame stream from a file-like object in bounded chunks
+    Yields (n, height, width) arrays of at most frames_per_chunk frames
+    """
+    header = stream.read(RAW_HEADER.size)
+    if len(header) < RAW_HEADER.size:
+        raise ValueError('Pressure frame stream is shorter than its header')
+    height, width = RAW_HEADER.unpack(header)
+    _check_shape((height, width))
+    frame_bytes = height * width * 4
+
+    pending = b''
+    while True:
+        chunk = stream.read(frame_bytes * frames_per_chunk - len(pending))
+        if not chunk:
+            break
+        pending += chunk
+        whole = len(pending) // frame_bytes
+        if whole == frames_per_chunk:
+            yield np.frombuffer(pending, dtype='<f4').reshape(whole, height, width)
+            pending = b''
+
+    if len(pending) % frame_bytes:
+        raise ValueError(f'Pressure frame stream ended inside a {height}x{width} frame')
+    if pending:
+        yield np.frombuffer(pending, dtype='<f4').reshape(-1, height, width)
+
+def as_pressure_matrix(value):
+    """
+    Pressure matrix ndarray from any supported representation
+    Raises ValueError unless it is a non-empty 2-D grid
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return decode_bytes(value)
+    if isinstance(value, dict):
+        data = value['data']
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        return _frombuffer(data, value.get('dtype', '<f4'), value['shape'])
+
+    matrix = value if isinstance(value, np.ndarray) else np.asarray(value, dtype=np.float64)
+    _check_shape(matrix.shape)
+    return matrix
+
+def as_pressure_frames(value):
+    """
+    (frames, height, width) ndarray from any supported gait representation
+    """
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return decode_frames(value)
+    if isinstance(value, dict):
+        data = value['data']
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        return _frombuffer(data, value.get('dtype', '<f4'), value['shape'], ndim=3)
+
+    frames = np.asarray(value, dtype=np.float64)
+    _check_shape(frames.shape, ndim=3)
+    return frames
+
+def unpack_msgpack(body):
+    """
+    Exam payload from a msgpack request body
+    """
+    import msgpack
+    return msgpack.unpackb(body, raw=False)
@@ -0,0 +1,112 @@
+"""
+Multi-horizon disease progression engine
+
+Current risk is computed once per patient and every horizon is evaluated in a
+single array operation, so dense grids (e.g. 120 monthly points for the dashboard
+curves) cost about the same as the five yearly timeframes.
+"""
+import numpy as np
+
+# Yearly progression rates
+ULCERATION_GROWTH_RATE = 0.1
+NEUROPATHY_RATE = 0.05
+PRESSURE_RATE = 0.04
+DEFORMITY_RATE = 0.03
+
+# Timeframes (years) reported in progression_predictions
+DEFAULT_HORIZONS = (1, 2, 3, 5, 10)
+
+COMPONENTS = ('ulceration_risk', 'neuropathy_decline', 'pressure_increase', 'deformity_progression')
+
+def horizon_label(years):
+    """
+    Key used for a horizon in progression_predictions: year_N, or month_N for
+    horizons that are not a whole number of years
+    """
+    if float(years).is_integer():
+        return f'year_{int(years)}'
+    return f'month_{int(round(years * 12))}'
+
+def monthly_horizons(months):
+    """
+    Horizons (in years) for a monthly grid of the given length
+    """
+    return np.arange(1, months + 1) / 12
+
+class ProgressionCurve:
+    """
+    Array-backed progression result
+    values has shape (n_patients, len(COMPONENTS), n_horizons)
+    """
+    __slots__ = ('horizons', 'values')
+
+    def __init__(self, horizons, values):
+        self.horizons = horizons
+        self.values = values
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def to_dict(self, patient=0):
+        """
+        Serialize one patient to the progression_predictions shape:
+        {'year_1': {'ulceration_risk': ..., ...}, ...}
+        """
+        rows = self.values[patient].T.tolist()
+        return {
+            horizon_label(years): dict(zip(COMPONENTS, row))
+            for years, row in zip(self.horizons.tolist(), rows)
+        }
+
+    def to_series(self, patient=0):
+        """
+        Serialize one patient as column lists, as consumed by the dashboard charts
+        """
+        series = {'horizon_years': self.horizons.tolist()}
+        series.update(zip(COMPONENTS, self.values[patient].tolist()))
+        return series
+
+class ProgressionEngine:
+    """
+    Evaluates progression for many patients and horizons in one pass
+    """
+    def __init__(self, ulceration_growth_rate=ULCERATION_GROWTH_RATE, neuropathy_rate=NEUROPATHY_RATE,
+                 pressure_rate=PRESSURE_RATE, deformity_rate=DEFORMITY_RATE):
+        self.ulceration_growth_rate = ulceration_growth_rate
+        self.neuropathy_rate = neuropathy_rate
+        self.pressure_rate = pressure_rate
+        self.deformity_rate = deformity_rate
+
+    def evaluate(self, current_risk, neuropathy_score, max_pressure, horizons=DEFAULT_HORIZONS,
+                 neuropathy_slope=None, pressure_slope=None):
+        """
+        current_risk, neuropathy_score, max_pressure: scalars or 1-D arrays (one per patient)
+        horizons: sequence of horizons in years
+        neuropathy_slope, pressure_slope: optional observed change per year from the
+        patient's history (NaN where unknown); they replace the fixed rates
+        """
+        years = np.asarray(horizons, dtype=np.float64)
+        current_risk = np.atleast_1d(np.asarray(current_risk, dtype=np.float64))
+        neuropathy_score = np.atleast_1d(np.asarray(neuropathy_score, dtype=np.float64))
+        max_pressure = np.atleast_1d(np.asarray(max_pressure, dtype=np.float64))
+
+        values = np.empty((current_risk.shape[0], len(COMPONENTS), years.shape[0]))
+
+        # Ulceration risk grows linearly with time, capped at 1
+        np.multiply.outer(current_risk, 1 + self.ulceration_growth_rate * years, out=values[:, 0, :])
+        np.minimum(values[:, 0, :], 1.0, out=values[:, 0, :])
+
+        np.multiply.outer(neuropathy_score, self.neuropathy_rate * years, out=values[:, 1, :])
+        np.multiply.outer(max_pressure, self.pressure_rate * years, out=values[:, 2, :])
+        for component, slope in ((1, neuropathy_slope), (2, pressure_slope)):
+            if slope is None:
+                continue
+            slope = np.broadcast_to(np.asarray(slope, dtype=np.float64), current_risk.shape)
+            observed = ~np.isnan(slope)
+            # Improving trends do not reduce the projected decline below zero
+            values[observed, component, :] = np.multiply.outer(np.maximum(slope[observed], 0), years)
+
+        # Deformity depends on time only
+        values[:, 3, :] = self.deformity_rate * years * years
+
+        return ProgressionCurve(years, values)
@@ -0,0 +1,109 @@
+"""
+Declarative intervention recommendation rules
+
+Rules are read from a JSON file (RECOMMENDATION_RULES_PATH, by default
+recommendation_rules.json):
+
+    {"rules": [{"when": [{"feature": "max_pressure", "op": ">", "threshold": 250}],
+                "intervention": "Pressure Offloading", "timing": "2 months",
+                "urgency": "Critical", "effectiveness": 90, "description": "..."}]}
+
+A rule fires when all of its conditions hold; 'ulceration_risk' is the
+predicted risk, any other feature is read from the feature schema (features
+that were not extracted compare at their schema default). Fired rules are
+reported in file order.
+
+Conditions compile to (rule, column, comparison ufunc, threshold), so a batch
+is evaluated with one array comparison per condition. Each recommendation
+payload is built once: every patient that gets a recommendation shares the
+same dict, and patients with the same fired rules share the same list, so
+responses must treat them as read-only.
+"""
+import json
+
+import numpy as np
+
+from features import FEATURE_SCHEMA
+
+RISK_FEATURE = 'ulceration_risk'
+
+OPERATORS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '==': np.equal,
+    '!=': np.not_equal
+}
+
+PAYLOAD_FIELDS = ('intervention', 'timing', 'urgency', 'effectiveness', 'description')
+
+class RecommendationRules:
+    """
+    Compiled rule table over the columns of a feature schema
+    """
+    def __init__(self, rules, schema=FEATURE_SCHEMA):
+        self.schema = schema
+        self.payloads = []
+        self.conditions = []
+        for rule_index, rule in enumerate(rules):
+            missing = [field for field in PAYLOAD_FIELDS if field not in rule]
+            if missing:
+                raise ValueError(f'Recommendation rule {rule_index} is missing {", ".join(missing)}')
+            if not rule.get('when'):
+                raise ValueError(f'Recommendation rule {rule_index} has no conditions')
+            for condition in rule['when']:
+                feature, op = condition.get('feature'), condition.get('op', '>')
+                if feature != RISK_FEATURE and feature not in schema.index:
+                    raise ValueError(f'Recommendation rule {rule_index}: unknown feature {feature!r}')
+                if op not in OPERATORS:
+                    raise ValueError(f'Recommendation rule {rule_index}: unknown operator {op!r}')
+                column = None if feature == RISK_FEATURE else schema.index[feature]
+                self.conditions.append((rule_index, column, OPERATORS[op], float(condition['threshold'])))
+
+            payload = {field: rule[field] for field in PAYLOAD_FIELDS}
+            payload.update((key, value) for key, value in rule.items() if key not in payload and key != 'when')
+            self.payloads.append(payload)
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def fired(self, values, risks):
+        """
+        (n_patients, n_rules) boolean mask of the rules that fire
+        values: (n_patients, n_features) feature values, risks: (n_patients,)
+        """
+        mask = np.ones((values.shape[0], len(self.payloads)), dtype=bool)
+        for rule_index, column, op, threshold in self.conditions:
+            mask[:, rule_index] &= op(risks if column is None else values[:, column], threshold)
+        return mask
+
+    def evaluate(self, values, risks):
+        """
+        Recommendation list for each patient
+        """
+        values = np.atleast_2d(values)
+        risks = np.atleast_1d(np.asarray(risks, dtype=np.float64))
+        mask = self.fired(values, risks)
+        if mask.shape[0] == 1:
+            return [[self.payloads[j] for j in np.flatnonzero(mask[0])]]
+
+        # One list per distinct combination of fired rules, found through a bit
+        # code per patient (much faster than np.unique over rows)
+        if mask.shape[1] <= 63:
+            codes = mask @ (np.int64(1) << np.arange(mask.shape[1], dtype=np.int64))
+            _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+        else:
+            _, first, inverse = np.unique(mask, axis=0, return_index=True, return_inverse=True)
+        lists = [[self.payloads[j] for j in np.flatnonzero(mask[i])] for i in first]
+        return [lists[i] for i in inverse.ravel()]
+
+    def recommend(self, features, risk):
+        """
+        Recommendations for one FeatureVector
+        """
+        return self.evaluate(features.values, risk)[0]
+
+def load_recommendation_rules(path, schema=FEATURE_SCHEMA):
+    with open(path) as f:
+        return RecommendationRules(json.load(f)['rules'], schema)
@@ -0,0 +1,159 @@
+"""
+Startup diagnostics: import cost of the app and memory of the running workers
+
+    python startup.py imports [--top 15]
+    python startup.py workers [--pid MASTER_PID]
+
+'imports' imports the app in a fresh interpreter (python -X importtime) and
+reports the total import time, the slowest modules it imports, the resident
+memory afterwards and which heavy libraries were loaded.
+
+'workers' reads /proc for a running gunicorn master and its workers (Linux).
+With preload_app most of a worker's RSS is shared with the master, so PSS (RSS
+with each shared page divided between the processes sharing it) and private
+memory are the numbers to compare.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Libraries that should only be loaded when a request needs them, or by a model
+HEAVY_MODULES = ('pandas', 'scipy', 'sklearn', 'joblib', 'cv2', 'PIL', 'pyarrow')
+
+IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+from startup import HEAVY_MODULES, process_memory
+print(json.dumps({
+    "import_seconds": seconds,
+    "memory": process_memory(),
+    "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+    "model_loaded": app.predictor.ulceration_model is not None
+}))
+'''
+
+def process_memory(pid='self'):
+    """
+    RSS, PSS and private memory of a process in MB (PSS and private need
+    /proc/<pid>/smaps_rollup, Linux 4.14+)
+    """
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                    fields[key] = int(rest.split()[0]) / 1024
+    except OSError:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return {'rss_mb': int(line.split()[1]) / 1024}
+        return {}
+
+    return {
+        'rss_mb': fields['Rss'],
+        'pss_mb': fields['Pss'],
+        'private_mb': fields['Private_Clean'] + fields['Private_Dirty']
+    }
+
+def parse_importtime(stderr, top=15):
+    """
+    Slowest modules imported directly by the probe's imports, from -X importtime output
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        cumulative_us, name = line.split('|')[1:]
+        # Nesting depth is given by the indentation of the module name
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        if depth == 1:
+            modules.append({'module': name.strip(), 'cumulative_ms': int(cumulative_us) / 1000})
+    modules.sort(key=lambda module: module['cumulative_ms'], reverse=True)
+    return modules[:top]
+
+def import_report(top=15):
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_PROBE], cwd=backend_dir,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['slowest_imports'] = parse_importtime(result.stderr, top)
+    return report
+
+def _parent_pid(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        # The command name may contain spaces; fields after it are space separated
+        return int(f.read().rsplit(')', 1)[1].split()[1])
+
+def _is_gunicorn(pid):
+    # gunicorn runs as 'gunicorn ...' or 'python .../gunicorn ...'
+    with open(f'/proc/{pid}/cmdline', 'rb') as f:
+        args = f.read().decode(errors='replace').split('\0')[:2]
+    return any(os.path.basename(arg).startswith('gunicorn') for arg in args)
+
+def _processes():
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                pids.append((int(entry), _parent_pid(entry), _is_gunicorn(entry)))
+            except OSError:
+                continue
+    return pids
+
+def find_gunicorn_master():
+    processes = _processes()
+    gunicorn = {pid for pid, _, is_gunicorn in processes if is_gunicorn}
+    for pid, parent, _ in processes:
+        if pid in gunicorn and parent not in gunicorn:
+            return pid
+    return None
+
+def worker_report(master_pid=None):
+    master_pid = master_pid or find_gunicorn_master()
+    if master_pid is None:
+        raise RuntimeError('No running gunicorn master found; pass --pid')
+
+    workers = [
+        dict(pid=pid, **process_memory(pid))
+        for pid, parent, _ in _processes() if parent == master_pid
+    ]
+    report = {
+        'master': dict(pid=master_pid, **process_memory(master_pid)),
+        'workers': workers
+    }
+    for field in ('rss_mb', 'pss_mb', 'private_mb'):
+        if all(field in process for process in [report['master']] + workers):
+            report[f'total_{field}'] = report['master'][field] + sum(worker[field] for worker in workers)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Startup diagnostics')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    imports = commands.add_parser('imports', help='import time and memory of the app')
+    imports.add_argument('--top', type=int, default=15, help='slowest imports listed')
+
+    workers = commands.add_parser('workers', help='memory of a running gunicorn master and its workers')
+    workers.add_argument('--pid', type=int, default=None, help='gunicorn master pid (default: found in /proc)')
+
+    args = parser.parse_args(argv)
+
+    try:
+        report = import_report(args.top) if args.command == 'imports' else worker_report(args.pid)
+    except (OSError, RuntimeError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Parquet round trip of the cohort rescoring CLI
+
+    cd backend && python -m pytest test_cohort.py
+"""
+import json
+import os
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+import cohort
+
+# Modalities and nested fields present in one exam and missing from the other,
+# so the Parquet schema has null struct fields in both rows
+EXAMS = [
+    {
+        'patient_id': 'p1',
+        'neurotouch': {
+            'monofilament': {'risk_score': 0.4, 'tactile_sensation': 0.5, 'affected_points': ['heel']},
+            'vibration': {'risk_score': 0.6, 'threshold': 20.0}
+        },
+        'pedoscan': {'pressure_matrix': [[0.0, 120.5], [250.0, 310.0], [80.0, 0.0]]}
+    },
+    {
+        'patient_id': 'p2',
+        'neurotouch': {
+            'monofilament': {'risk_score': 0.2, 'tactile_sensation': 0.9, 'affected_points': []},
+            'cold_perception': {'risk_score': 0.3, 'threshold': 10.0}
+        },
+        'pedoscan': {'pressure_matrix': [[90.0, 210.0, 0.0], [0.0, 140.0, 60.0]]},
+        'arterial': {'abi': {'right': 0.9, 'left': 0.7}, 'tbi': {'right': 0.6, 'left': 0.5}}
+    }
+]
+
+def write_archives(tmp_path):
+    jsonl_path = tmp_path / 'exams.jsonl'
+    jsonl_path.write_text(''.join(json.dumps(exam) + '\n' for exam in EXAMS))
+    parquet_path = tmp_path / 'exams.parquet'
+    # The schema is inferred from every exam, as it would be for an exported archive
+    pq.write_table(pa.Table.from_struct_array(pa.array(EXAMS)), parquet_path)
+    return str(jsonl_path), str(parquet_path)
+
+def test_parquet_rows_decode_to_the_original_exams(tmp_path):
+    _, parquet_path = write_archives(tmp_path)
+    decoded = [
+        record
+        for start, records in cohort.iter_chunks(parquet_path, 10)
+        for record in cohort.decode_records(start, records)
+    ]
+    assert [error for _, _, error in decoded] == [None, None]
+    assert [exam for _, exam, _ in decoded] == EXAMS
+
+def test_parquet_and_jsonl_archives_score_alike(tmp_path):
+    jsonl_path, parquet_path = write_archives(tmp_path)
+    results = {}
+    for name, path in (('jsonl', jsonl_path), ('parquet', parquet_path)):
+        output_dir = os.path.join(tmp_path, f'{name}-results')
+        report = cohort.score_cohort(path, output_dir, chunk_size=10, workers=1, log=lambda message: None)
+        assert report['rows'] == len(EXAMS)
+        assert report['errors'] == 0
+        results[name] = pq.read_table(output_dir).sort_by('row').to_pylist()
+
+    assert results['jsonl'] == results['parquet']